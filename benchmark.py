@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+from timeit import default_timer
+
+# Everything runs without a real display; must be set before pygame is initialized
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+import pygame
+
+from game_agents import ACTIONS
+from game_sim import Game
+from lib import pygametext
+
+# Usage:
+#
+#     python benchmark.py --output baseline.json
+#     python benchmark.py --baseline baseline.json          # exits with 1 if anything got slower
+#
+# Every benchmark times single iterations of one hot path and reports the throughput and latency
+# percentiles. Work that only sets up the next iteration (e.g. topping up projectiles) isn't timed.
+
+PROJECTILE_COUNTS = (1, 10, 100, 1000)
+
+
+def bench_headless_step():
+    game = Game(headless=True, max_round_steps=1000)
+    game.reset()
+    state = {'done': False}
+
+    def step():
+        observations, rewards, state['done'], info = game.step([random.choice(ACTIONS) for _ in game.player_agents])
+
+    def between():
+        if state['done']:
+            game.reset()
+
+    return step, between
+
+
+def bench_rendered_step():
+    # One pass of the play_round() loop without the frame cap: input, tick, render. Nobody presses keys
+    # under the dummy driver, so the agents act randomly to give the renderer something to redraw.
+    game = Game(render_every=1, tick_rate=None)
+    game.start_round()
+
+    def step():
+        keys = pygame.key.get_pressed()
+        events = pygame.event.get()
+        for agent in game.player_agents:
+            agent.act(random.choice(ACTIONS))
+        game.tick(keys=keys, events=events)
+        game.render()
+        game.clock.tick()
+
+    def between():
+        if not game.round_not_over:
+            game.start_round()
+
+    return step, between
+
+
+def bench_projectiles(count):
+    # count projectiles flying across the middle of the arena, away from both tanks
+    def setup():
+        game = Game(headless=True)
+        game.reset(placements=[(0, 0, 0), (game.canvas_length - 32, 0, 0)])
+        store = game.all_projectile_sprites
+        agent = game.player_agents[0]
+
+        def top_up():
+            while len(store) < count:
+                store.spawn(start_x=random.randrange(50, game.canvas_length - 50),
+                            start_y=random.randrange(100, game.canvas_width - 50),
+                            move_direction=random.choice((90, 270)), agent=agent)
+
+        top_up()
+        return store.update, top_up
+
+    return setup
+
+
+def bench_fire_rotate():
+    game = Game(headless=True)
+    game.reset()
+    tank = game.player_agents[0].sprite
+
+    def step():
+        tank.fire()
+        tank.rotate90(rotation='clockwise')
+
+    return step, game.all_projectile_sprites.empty
+
+
+def bench_hud():
+    # A changed score makes the HUD render its text and push the strip to the display
+    game = Game()
+    game.start_round()
+    agent = game.player_agents[0]
+
+    def between():
+        agent.score += 1
+
+    return game.hud_sprite.update, between
+
+
+def bench_getsurf_hit():
+    pygametext.getsurf('Human: 0', None, 36, None, color='white')
+
+    def step():
+        pygametext.getsurf('Human: 0', None, 36, None, color='white')
+
+    return step, None
+
+
+def bench_getsurf_miss():
+    counter = [0]
+
+    def step():
+        pygametext.getsurf('Human: %d' % counter[0], None, 36, None, color='white')
+
+    def between():
+        counter[0] += 1
+
+    return step, between
+
+
+BENCHMARKS = [('headless_step', bench_headless_step), ('rendered_step', bench_rendered_step)]
+BENCHMARKS += [('projectiles_%d' % count, bench_projectiles(count)) for count in PROJECTILE_COUNTS]
+BENCHMARKS += [('fire_rotate', bench_fire_rotate), ('hud_update', bench_hud),
+               ('getsurf_hit', bench_getsurf_hit), ('getsurf_miss', bench_getsurf_miss)]
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(setup, iterations, warmup):
+    step, between = setup()
+    samples = []
+    for i in range(warmup + iterations):
+        start = default_timer()
+        step()
+        elapsed = default_timer() - start
+        if i >= warmup:
+            samples.append(elapsed)
+        if between is not None:
+            between()
+
+    ordered = sorted(samples)
+    return {
+        'iterations': iterations,
+        'steps_per_second': iterations / sum(samples),
+        'mean_us': 1e6 * sum(samples) / iterations,
+        'p50_us': 1e6 * percentile(ordered, 0.5),
+        'p90_us': 1e6 * percentile(ordered, 0.9),
+        'p99_us': 1e6 * percentile(ordered, 0.99),
+        'max_us': 1e6 * ordered[-1],
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Median latency against the baseline; returns the names of the benchmarks that got slower than the
+    # tolerance allows
+    regressions = []
+    print('\n%-16s %12s %12s %8s' % ('benchmark', 'baseline us', 'current us', 'change'))
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            print('%-16s %12s %12.1f %8s' % (name, '-', result['p50_us'], 'new'))
+            continue
+        old, new = baseline[name]['p50_us'], result['p50_us']
+        change = new / old - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-16s %12.1f %12.1f %+7.1f%%%s' % (name, old, new, 100 * change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulation and render hot paths')
+    parser.add_argument('--iterations', type=int, default=1000, help='timed iterations per benchmark')
+    parser.add_argument('--warmup', type=int, default=100, help='untimed iterations before timing')
+    parser.add_argument('--filter', default='', help='only run the benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed slowdown of the median latency against the baseline')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    pygame.init()
+
+    results = {}
+    print('%-16s %12s %10s %10s %10s' % ('benchmark', 'steps/s', 'p50 us', 'p90 us', 'p99 us'))
+    for name, setup in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        result = measure(setup, args.iterations, args.warmup)
+        results[name] = result
+        print('%-16s %12.0f %10.1f %10.1f %10.1f' % (name, result['steps_per_second'], result['p50_us'],
+                                                     result['p90_us'], result['p99_us']))
+
+    report = {
+        'machine': {'python': platform.python_version(), 'pygame': pygame.version.ver,
+                    'platform': platform.platform(), 'processor': platform.processor()},
+        'iterations': args.iterations,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
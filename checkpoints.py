@@ -0,0 +1,156 @@
+import json
+import os
+import re
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+
+# Array names become file names
+_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+class CheckpointStore:
+    # Generations of agent parameters (dicts of NumPy arrays, e.g. QLearningAgent.get_params()) under a
+    # directory, with a manifest of the generation, iteration, score and seed of each, e.g.
+    #
+    #     store = CheckpointStore('checkpoints')
+    #     store.save(agent.get_params(), iteration=iteration, score=agent.score, seed=game.seed)
+    #     agent.set_params(store.load(store.latest()['generation']))
+    #
+    # Every keyframe_interval-th generation stores its arrays whole as .npy files, which load() memory-maps.
+    # The generations in between only store the elements that changed since the previous generation
+    # (flat indices and values), unless that is no smaller than the whole array. Loading one of those maps
+    # the keyframe and replays at most keyframe_interval - 1 deltas on a copy of it. With compress=True,
+    # arrays and deltas are zlib-compressed .npz files instead, which are smaller but can't be mapped.
+    def __init__(self, path, keyframe_interval=10, compress=False):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.compress = compress
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['version'] != VERSION:
+                raise ValueError('Unsupported checkpoint store version %d' % manifest['version'])
+            self.entries = manifest['generations']
+        else:
+            self.entries = []
+
+        # Parameters of the newest generation, which the next delta is taken against
+        self._previous = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def generations(self):
+        return list(self.entries)
+
+    def latest(self):
+        return self.entries[-1] if self.entries else None
+
+    def entry(self, generation):
+        for entry in self.entries:
+            if entry['generation'] == generation:
+                return entry
+        raise KeyError('No checkpoint for generation %r' % generation)
+
+    def _directory(self, generation):
+        return os.path.join(self.path, 'generation-%06d' % generation)
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump({'version': VERSION, 'generations': self.entries}, f, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def _save_array(self, directory, name, array):
+        if self.compress:
+            np.savez_compressed(os.path.join(directory, name + '.npz'), array=array)
+        else:
+            np.save(os.path.join(directory, name + '.npy'), array)
+
+    def _save_delta(self, directory, name, indices, values):
+        save = np.savez_compressed if self.compress else np.savez
+        save(os.path.join(directory, name + '.delta.npz'), indices=indices, values=values)
+
+    def save(self, params, iteration=None, score=None, seed=None, generation=None, **metadata):
+        # Store params as a new generation (one after the latest by default) and return its manifest entry
+        if generation is None:
+            generation = self.entries[-1]['generation'] + 1 if self.entries else 0
+        elif self.entries and generation <= self.entries[-1]['generation']:
+            raise ValueError('Generation %d is not after generation %d' % (generation, self.entries[-1]['generation']))
+        for name in params:
+            if not _NAME.match(name):
+                raise ValueError('Parameter name %r is not usable as a file name' % name)
+
+        params = dict((name, np.asarray(array)) for name, array in params.items())
+        keyframe = not self.entries or len(self.entries) % self.keyframe_interval == 0
+        previous = None
+        if not keyframe:
+            if self._previous is None:
+                self._previous = self.load(self.entries[-1]['generation'])
+            previous = self._previous
+
+        directory = self._directory(generation)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        arrays = {}
+        for name, array in params.items():
+            old = previous.get(name) if previous is not None else None
+            if old is not None and old.shape == array.shape and old.dtype == array.dtype:
+                indices = np.flatnonzero(array.ravel() != old.ravel())
+                # A delta costs an index and a value per changed element
+                if indices.size * (8 + array.itemsize) < array.nbytes:
+                    self._save_delta(directory, name, indices, array.ravel()[indices])
+                    arrays[name] = 'delta'
+                    continue
+            self._save_array(directory, name, array)
+            arrays[name] = 'full'
+
+        entry = {'generation': generation, 'iteration': iteration, 'score': score, 'seed': seed,
+                 'keyframe': keyframe, 'arrays': arrays}
+        entry.update(metadata)
+        self.entries.append(entry)
+        self._write_manifest()
+
+        self._previous = dict((name, np.array(array)) for name, array in params.items())
+        return entry
+
+    def _load_full(self, directory, name, mmap):
+        if os.path.exists(os.path.join(directory, name + '.npy')):
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None)
+        with np.load(os.path.join(directory, name + '.npz')) as data:
+            return data['array']
+
+    def load(self, generation, mmap=True):
+        # Parameters of a generation. Arrays stored whole are read-only memory maps (with mmap=True and
+        # compress=False); arrays rebuilt from deltas are in memory.
+        position = [entry['generation'] for entry in self.entries].index(generation)
+        start = position
+        while not self.entries[start]['keyframe']:
+            start -= 1
+
+        params = {}
+        for entry in self.entries[start:position + 1]:
+            directory = self._directory(entry['generation'])
+            for name, kind in entry['arrays'].items():
+                if kind == 'full':
+                    params[name] = self._load_full(directory, name, mmap)
+                    continue
+                with np.load(os.path.join(directory, name + '.delta.npz')) as data:
+                    indices, values = data['indices'], data['values']
+                array = params[name]
+                if not array.flags.writeable or isinstance(array, np.memmap):
+                    array = params[name] = np.array(array)
+                array.ravel()[indices] = values
+            # Arrays that a generation doesn't store any more are dropped
+            for name in list(params):
+                if name not in entry['arrays']:
+                    del params[name]
+        return params
@@ -0,0 +1,165 @@
+import json
+import socket
+import struct
+
+import numpy as np
+
+# Client of env_server.EnvServer, and the protocol both sides speak. Importing this module never imports
+# pygame or any of the game modules, so actors and learners can drive remote games without them, e.g.
+#
+#     client = EnvClient()                      # python env_server.py must be running
+#     games = [client.make(observer='features', max_round_steps=2000, seed=i) for i in range(64)]
+#     observations = client.reset_all(games)
+#     results = client.step_all(games, [policy(o) for o in observations])
+#
+# Actions are the numbers of game_agents.ACTIONS, one per agent of a game.
+
+DEFAULT_PATH = '/tmp/tanks-env.sock'
+
+# Every message is a header followed by `length` bytes of payload. Requests carry an id of the client's
+# choosing that their response repeats, so a client can have any number of requests in flight.
+HEADER = struct.Struct('<IIBI')                 # payload length, request id, opcode, session
+
+# Requests; a response has the opcode of its request, or ERROR with the message as payload
+CREATE, RESET, STEP, CLOSE, ERROR = range(5)
+
+# Payload of a STEP response before its arrays (rewards, then the observations): done, truncated, round steps
+STEP_RESULT = struct.Struct('<BBI')
+
+_ARRAY = struct.Struct('<4sB')                  # dtype, number of dimensions; the shape follows as uint32s
+
+
+class EnvServerError(Exception):
+    pass
+
+
+def encode_arrays(arrays):
+    # Arrays as dtype, shape and raw bytes each, behind a count
+    parts = [struct.pack('<B', len(arrays))]
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        parts.append(_ARRAY.pack(array.dtype.str.encode('ascii'), array.ndim))
+        parts.append(struct.pack('<%dI' % array.ndim, *array.shape))
+        parts.append(array.data)
+    return b''.join(parts)
+
+
+def decode_arrays(payload, offset=0):
+    # Inverse of encode_arrays(). The arrays are read-only views of the payload, not copies.
+    count, = struct.unpack_from('<B', payload, offset)
+    offset += 1
+    arrays = []
+    for _ in range(count):
+        dtype, ndim = _ARRAY.unpack_from(payload, offset)
+        offset += _ARRAY.size
+        shape = struct.unpack_from('<%dI' % ndim, payload, offset)
+        offset += 4 * ndim
+        dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        size = int(np.prod(shape)) if ndim else 1
+        arrays.append(np.frombuffer(payload, dtype, size, offset).reshape(shape))
+        offset += size * dtype.itemsize
+    return arrays
+
+
+def _observations(arrays):
+    # A single array, or a tuple of arrays for observers whose observations have several parts
+    return arrays[0] if len(arrays) == 1 else tuple(arrays)
+
+
+class RemoteGame:
+    # One game hosted by the server; reset() and step() behave like those of game_sim.Game, except that
+    # observations are arrays with one row per agent
+    def __init__(self, client, session, num_agents, seed):
+        self.client = client
+        self.session = session
+        self.num_agents = num_agents
+        self.seed = seed
+
+    def reset(self):
+        return self.client.reset_all([self])[0]
+
+    def step(self, actions):
+        return self.client.step_all([self], [actions])[0]
+
+    def close(self):
+        self.client.call(CLOSE, self.session)
+
+
+class EnvClient:
+    # Blocking client over a Unix socket (path) or TCP (address=(host, port)). reset_all() and step_all()
+    # send the requests for all their games at once and only then wait for the responses, so the server
+    # steps the games together and a round trip is paid once per batch rather than once per game.
+    def __init__(self, path=DEFAULT_PATH, address=None):
+        if address is not None:
+            self.socket = socket.create_connection(address)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+        self.reader = self.socket.makefile('rb')
+        self.next_id = 0
+        # Responses that arrived while waiting for another one
+        self.responses = {}
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def send(self, requests):
+        # Send (opcode, session, payload) requests in one write and return their ids
+        ids = []
+        frames = []
+        for opcode, session, payload in requests:
+            self.next_id = (self.next_id + 1) & 0xffffffff
+            ids.append(self.next_id)
+            frames.append(HEADER.pack(len(payload), self.next_id, opcode, session))
+            frames.append(payload)
+        self.socket.sendall(b''.join(frames))
+        return ids
+
+    def receive(self, request_id):
+        # (opcode, session, payload) of the response to a request
+        while request_id not in self.responses:
+            header = self.reader.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise EnvServerError('Connection closed by the server')
+            length, response_id, opcode, session = HEADER.unpack(header)
+            self.responses[response_id] = opcode, session, self.reader.read(length)
+
+        opcode, session, payload = self.responses.pop(request_id)
+        if opcode == ERROR:
+            raise EnvServerError(payload.decode('utf-8'))
+        return opcode, session, payload
+
+    def call(self, opcode, session=0, payload=b''):
+        return self.receive(self.send([(opcode, session, payload)])[0])
+
+    def make(self, **config):
+        # Create a headless game on the server. The config takes the length, width, max_round_steps and
+        # seed arguments of game_sim.Game, and observer: None, 'features', 'occupancy' or 'pixels'.
+        opcode, session, payload = self.call(CREATE, 0, json.dumps(config).encode('utf-8'))
+        info = json.loads(payload.decode('utf-8'))
+        return RemoteGame(self, session, info['num_agents'], info['seed'])
+
+    def reset_all(self, games):
+        ids = self.send([(RESET, game.session, b'') for game in games])
+        return [_observations(decode_arrays(self.receive(request_id)[2])) for request_id in ids]
+
+    def step_all(self, games, actions):
+        # One (observations, rewards, done, info) per game, as game_sim.Game.step() returns them
+        ids = self.send([(STEP, game.session, np.asarray(game_actions, dtype=np.uint8).tobytes())
+                         for game, game_actions in zip(games, actions)])
+        results = []
+        for request_id in ids:
+            payload = self.receive(request_id)[2]
+            done, truncated, round_steps = STEP_RESULT.unpack_from(payload)
+            arrays = decode_arrays(payload, STEP_RESULT.size)
+            results.append((_observations(arrays[1:]), arrays[0], bool(done),
+                            {'round_steps': round_steps, 'truncated': bool(truncated)}))
+        return results
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+
+import numpy as np
+
+from env_client import (HEADER, CREATE, RESET, STEP, CLOSE, ERROR, STEP_RESULT, DEFAULT_PATH, encode_arrays)
+from game_observations import OBSERVERS
+from game_sim import Game
+
+# Usage:
+#
+#     python env_server.py                          # Unix socket at env_client.DEFAULT_PATH
+#     python env_server.py --port 7000              # TCP on localhost instead
+#
+# Hosts headless games for env_client.EnvClient. All connections share one event loop: their handlers
+# only parse requests and queue them, and a single batch task runs everything queued since its last pass
+# (often the steps of hundreds of games) and then writes the responses, one write per connection. The
+# batch task never waits for a socket: each handler waits for its own connection's responses to drain
+# before reading more requests, so a client that doesn't read its responses only holds up itself.
+
+# Game arguments a client may set; games on the server are always headless
+GAME_ARGUMENTS = ('length', 'width', 'max_round_steps', 'seed')
+
+# Requests one connection may have queued for the batch task; its handler stops reading beyond that
+MAX_QUEUED_REQUESTS = 1024
+
+
+def observation_arrays(observations):
+    # What the observers return as a list of arrays: one array with a row per agent, or one per part for
+    # observers with several arrays per agent (e.g. OccupancyObserver)
+    if isinstance(observations, np.ndarray):
+        return [observations]
+    if isinstance(observations[0][0], np.ndarray):
+        return [np.stack(parts) for parts in zip(*observations)]
+    return [np.array(observations, dtype=np.int32)]
+
+
+class _Connection:
+    def __init__(self, writer):
+        self.writer = writer
+        # Sessions created by the connection, closed when it goes away
+        self.sessions = set()
+        # Requests waiting in the batch queue, and set whenever there is room for more
+        self.queued = 0
+        self.room = asyncio.Event()
+        self.room.set()
+        self.closed = False
+
+
+class EnvServer:
+    def __init__(self, path=DEFAULT_PATH, address=None, max_sessions=4096, max_queued=MAX_QUEUED_REQUESTS):
+        self.path = path
+        self.address = address
+        self.max_sessions = max_sessions
+        self.max_queued = max_queued
+
+        self.games = {}
+        self.session_ids = itertools.count(1)
+
+        # Requests (connection, request id, opcode, session, payload) waiting for the next batch
+        self.pending = []
+        self.wakeup = None
+        self.server = None
+        self.batch_task = None
+        self.batches = 0
+        self.requests = 0
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        if self.address is not None:
+            self.server = await asyncio.start_server(self.handle_connection, *self.address)
+        else:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.server = await asyncio.start_unix_server(self.handle_connection, self.path)
+        self.batch_task = asyncio.ensure_future(self.run_batches())
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.batch_task
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            self.batch_task.cancel()
+            if self.address is None and os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def handle_connection(self, reader, writer):
+        connection = _Connection(writer)
+        try:
+            while True:
+                length, request_id, opcode, session = HEADER.unpack(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(length) if length else b''
+                self.pending.append((connection, request_id, opcode, session, payload))
+                self.wakeup.set()
+
+                connection.queued += 1
+                if connection.queued >= self.max_queued:
+                    connection.room.clear()
+                    await connection.room.wait()
+                # Responses the client hasn't read yet stop this connection, and only this one
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            connection.closed = True
+            for session in connection.sessions:
+                self.games.pop(session, None)
+            writer.close()
+
+    async def run_batches(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            batch, self.pending = self.pending, []
+
+            responses = {}
+            for connection, request_id, opcode, session, payload in batch:
+                connection.queued -= 1
+                if connection.closed:
+                    continue
+                try:
+                    session, payload = self.handle_request(connection, opcode, session, payload)
+                except Exception as e:
+                    opcode, payload = ERROR, ('%s: %s' % (type(e).__name__, e)).encode('utf-8')
+                responses.setdefault(connection, []).extend((HEADER.pack(len(payload), request_id, opcode,
+                                                                         session), payload))
+            self.batches += 1
+            self.requests += len(batch)
+
+            # write() only buffers; draining is left to each connection's handler
+            for connection, frames in responses.items():
+                connection.writer.write(b''.join(frames))
+            for connection, request_id, opcode, session, payload in batch:
+                connection.room.set()
+
+    def handle_request(self, connection, opcode, session, payload):
+        # Returns the session and payload of the response
+        if opcode == CREATE:
+            config = json.loads(payload.decode('utf-8'))
+            observer = OBSERVERS[config.pop('observer', None)]
+            unknown = set(config) - set(GAME_ARGUMENTS)
+            if unknown:
+                raise ValueError('Unknown game arguments %s' % ', '.join(sorted(unknown)))
+            if len(self.games) >= self.max_sessions:
+                raise RuntimeError('Too many sessions (%d)' % self.max_sessions)
+            game = Game(headless=True, observer=observer, **config)
+            session = next(self.session_ids)
+            self.games[session] = game
+            connection.sessions.add(session)
+            info = {'num_agents': len(game.player_agents), 'seed': game.seed}
+            return session, json.dumps(info).encode('utf-8')
+
+        if session not in connection.sessions:
+            raise KeyError('No session %d on this connection' % session)
+        game = self.games[session]
+
+        if opcode == RESET:
+            return session, encode_arrays(observation_arrays(game.reset()))
+        if opcode == STEP:
+            if len(payload) != len(game.player_agents):
+                raise ValueError('Expected %d actions, got %d' % (len(game.player_agents), len(payload)))
+            observations, rewards, done, info = game.step(bytearray(payload))
+            arrays = [np.array(rewards, dtype=np.int32)] + observation_arrays(observations)
+            return session, STEP_RESULT.pack(done, info['truncated'], info['round_steps']) + encode_arrays(arrays)
+        if opcode == CLOSE:
+            connection.sessions.discard(session)
+            del self.games[session]
+            return session, b''
+        raise ValueError('Unknown opcode %d' % opcode)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve headless games to env_client.EnvClient')
+    parser.add_argument('--path', default=DEFAULT_PATH, help='Unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='listen on TCP instead of the Unix socket')
+    parser.add_argument('--max-sessions', type=int, default=4096)
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED_REQUESTS,
+                        help='requests one connection may have waiting for the batch task')
+    args = parser.parse_args(argv)
+
+    address = (args.host, args.port) if args.port is not None else None
+    server = EnvServer(args.path, address, args.max_sessions, args.max_queued)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
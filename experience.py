@@ -0,0 +1,231 @@
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (e.g. Windows): the buffer must only be written by one process at a time
+    fcntl = None
+
+# A batch of transitions drawn by ExperienceBuffer.sample(); weights are the importance-sampling
+# corrections of prioritized sampling (all ones when sampling uniformly)
+Batch = namedtuple('Batch', ['indices', 'observations', 'actions', 'rewards', 'next_observations', 'dones',
+                             'weights'])
+
+VERSION = 1
+
+# Mutable state shared by every process that has the buffer open
+HEADER_DTYPE = np.dtype([('position', '<i8'), ('added', '<i8'), ('valid', '<i8'), ('max_priority', '<f8')])
+
+
+class ExperienceBuffer:
+    # Ring buffer of transitions kept in np.memmap files under a directory, so that it can hold far more
+    # transitions than fit in RAM and be shared by several rollout processes, e.g.
+    #
+    #     buffer = ExperienceBuffer('experience', capacity=50000000)   # creates the files
+    #     buffer = ExperienceBuffer('experience')                      # opens them in another process
+    #     buffer.add(observations, actions, rewards, next_observation, done)
+    #     batch = buffer.sample(256)
+    #
+    # Every slot holds an observation. Slot i is also a transition when valid[i] is set: the agent took
+    # actions[i] in observations[i], got rewards[i], and saw observations[next_indices[i]] next. A sequence of
+    # transitions takes one slot more than it has transitions, for the observation after the last one, and
+    # overwriting a slot invalidates the transition that pointed at it as its next observation.
+    #
+    # Sampling goes through a sum tree over the slot priorities (zero for slots that aren't transitions),
+    # so uniform and prioritized sampling both cost O(log capacity) per sample.
+    def __init__(self, path, capacity=None, observation_shape=(6,), observation_dtype='int16', prioritized=False,
+                 alpha=0.6):
+        self.path = path
+        meta_path = os.path.join(path, 'meta.json')
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['version'] != VERSION:
+                raise ValueError('Unsupported experience buffer version %d' % meta['version'])
+            mode = 'r+'
+        else:
+            if capacity is None:
+                raise ValueError('capacity is required to create a new experience buffer')
+            meta = {'version': VERSION, 'capacity': int(capacity), 'observation_shape': list(observation_shape),
+                    'observation_dtype': np.dtype(observation_dtype).str, 'prioritized': prioritized,
+                    'alpha': alpha}
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            mode = 'w+'
+
+        self.capacity = meta['capacity']
+        self.observation_shape = tuple(meta['observation_shape'])
+        self.prioritized = meta['prioritized']
+        self.alpha = meta['alpha']
+
+        # Leaves of the sum tree start at tree_size, the root is at 1 and index 0 is unused
+        self.tree_size = 1
+        while self.tree_size < self.capacity:
+            self.tree_size *= 2
+        self.tree_depth = self.tree_size.bit_length() - 1
+
+        self._lock_file = open(os.path.join(path, 'lock'), 'a+')
+        with self._locked():
+            self.header = self._open('header', HEADER_DTYPE, (1,), mode)
+            self.observations = self._open('observations', meta['observation_dtype'],
+                                           (self.capacity,) + self.observation_shape, mode)
+            self.actions = self._open('actions', np.uint8, (self.capacity,), mode)
+            self.rewards = self._open('rewards', np.float32, (self.capacity,), mode)
+            self.dones = self._open('dones', np.bool_, (self.capacity,), mode)
+            self.next_indices = self._open('next_indices', np.int32, (self.capacity,), mode)
+            self.valid = self._open('valid', np.bool_, (self.capacity,), mode)
+            self.tree = self._open('priorities', np.float64, (2 * self.tree_size,), mode)
+
+            if mode == 'w+':
+                self.header['max_priority'] = 1.0
+                self._flush()
+                # Written last, so that other processes never open a half-created buffer
+                with open(meta_path, 'w') as f:
+                    json.dump(meta, f)
+
+    def _open(self, name, dtype, shape, mode):
+        return np.memmap(os.path.join(self.path, name + '.dat'), dtype=dtype, mode=mode, shape=shape)
+
+    def _locked(self, shared=False):
+        return _FileLock(self._lock_file, shared)
+
+    def _flush(self):
+        for array in (self.header, self.observations, self.actions, self.rewards, self.dones, self.next_indices,
+                      self.valid, self.tree):
+            array.flush()
+
+    def __len__(self):
+        # Number of transitions that can currently be sampled
+        return int(self.header['valid'][0])
+
+    def _set_priorities(self, indices, priorities):
+        # Set the leaves, then recompute their ancestors one level at a time
+        nodes = np.asarray(indices, dtype=np.int64) + self.tree_size
+        self.tree[nodes] = priorities
+        for _ in range(self.tree_depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def _invalidate(self, indices):
+        indices = indices[self.valid[indices]]
+        if len(indices):
+            self.valid[indices] = False
+            self.header['valid'] -= len(indices)
+            self._set_priorities(indices, 0.0)
+
+    def add(self, observations, actions, rewards, next_observation, done=False):
+        # Append a sequence of consecutive transitions: the next observation of each is the observation of
+        # the one after it, and of the last one next_observation. done is True if the round ended after the
+        # last transition and False if the sequence was cut off (or continues in a later add()).
+        count = len(actions)
+        if count == 0:
+            return
+        if count + 1 > self.capacity:
+            raise ValueError('%d transitions do not fit in a buffer of capacity %d' % (count, self.capacity))
+
+        with self._locked():
+            start = int(self.header['position'][0])
+            slots = (start + np.arange(count + 1)) % self.capacity
+            transitions = slots[:-1]
+
+            # The overwritten slots stop being transitions. Every add() ends on a slot of its own for the
+            # last next observation, so the slot before start is never a transition that points into them.
+            self._invalidate(slots)
+
+            self.observations[slots[:-1]] = observations
+            self.observations[slots[-1]] = next_observation
+            self.actions[transitions] = actions
+            self.rewards[transitions] = rewards
+            self.dones[transitions] = False
+            self.dones[transitions[-1]] = done
+            self.next_indices[transitions] = slots[1:]
+
+            # New transitions get the highest priority so far, which makes sure each is sampled at least once
+            self.valid[transitions] = True
+            priority = self.header['max_priority'][0] ** self.alpha if self.prioritized else 1.0
+            self._set_priorities(transitions, priority)
+
+            self.header['position'] = (slots[-1] + 1) % self.capacity
+            self.header['added'] += count
+            self.header['valid'] += count
+
+    def sample(self, batch_size, beta=0.4, rng=np.random):
+        # Draw batch_size transitions, with probability proportional to their priority**alpha when the
+        # buffer is prioritized and uniformly otherwise. beta is the strength of the importance-sampling
+        # correction in Batch.weights.
+        with self._locked(shared=True):
+            total = self.tree[1]
+            if total <= 0:
+                raise ValueError('The experience buffer has no transitions to sample')
+
+            # One sample from each of batch_size equal segments of the total priority
+            values = (np.arange(batch_size) + rng.random_sample(batch_size)) * (total / batch_size)
+            nodes = np.ones(batch_size, dtype=np.int64)
+            for _ in range(self.tree_depth):
+                nodes *= 2
+                left = self.tree[nodes]
+                go_right = values >= left
+                values -= left * go_right
+                nodes += go_right
+            indices = nodes - self.tree_size
+
+            # Rounding can walk a sample off the last slot with a priority; move it back onto one
+            stray = (indices >= self.capacity) | ~self.valid[np.minimum(indices, self.capacity - 1)]
+            if stray.any():
+                valid_indices = np.flatnonzero(self.valid)
+                indices[stray] = valid_indices[rng.randint(len(valid_indices), size=int(stray.sum()))]
+
+            next_indices = self.next_indices[indices]
+            batch = Batch(indices, np.array(self.observations[indices]), np.array(self.actions[indices]),
+                          np.array(self.rewards[indices]), np.array(self.observations[next_indices]),
+                          np.array(self.dones[indices]), np.ones(batch_size, dtype=np.float32))
+
+            if self.prioritized:
+                probabilities = self.tree[indices + self.tree_size] / total
+                weights = (len(self) * probabilities) ** -beta
+                batch = batch._replace(weights=(weights / weights.max()).astype(np.float32))
+
+        return batch
+
+    def update_priorities(self, indices, priorities):
+        # Set the priorities (e.g. absolute TD errors) of sampled transitions. Transitions overwritten since
+        # they were sampled are skipped.
+        if not self.prioritized:
+            return
+        priorities = np.asarray(priorities, dtype=np.float64)
+
+        with self._locked():
+            indices = np.asarray(indices)
+            keep = self.valid[indices]
+            indices, priorities = indices[keep], priorities[keep]
+            if len(indices):
+                self.header['max_priority'] = max(self.header['max_priority'][0], priorities.max())
+                self._set_priorities(indices, priorities ** self.alpha)
+
+    def flush(self):
+        with self._locked():
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self._lock_file.close()
+
+
+class _FileLock:
+    # Advisory lock on the buffer's lock file, shared for readers and exclusive for writers
+    def __init__(self, lock_file, shared):
+        self.lock_file = lock_file
+        self.shared = shared
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
@@ -1,46 +1,243 @@
+import numpy as np
 from pygame.locals import *
 
+# Discrete actions an agent can submit to the game, one per step
+NOOP = 0
+FORWARD = 1
+REVERSE = 2
+CLOCKWISE = 3
+ANTICLOCKWISE = 4
+FIRE = 5
+ACTIONS = (NOOP, FORWARD, REVERSE, CLOCKWISE, ANTICLOCKWISE, FIRE)
 
-class HumanAgent:
+
+class Agent:
     def __init__(self, name, game_obj):
         self.name = name
         self.game = game_obj
         self.sprite = None
         self.score = 0
 
-    def take_action(self, **kwargs):
-        keys = []
-        events = []
-        # Parse kwargs
-        for kwarg in kwargs:
-            if kwarg == "keys":
-                keys = kwargs[kwarg]
-            elif kwarg == "events":
-                events = kwargs[kwarg]
-            else:
-                raise KeyError
-
-        # Check what keys are pressed, take an action accordingly
-        if keys[K_w]:
+        # Bit mask of the actions taken during the current tick, read by the replay recorder
+        self.tick_actions = 0
+
+    def act(self, action):
+        # Apply a single discrete action to the tank controlled by this agent
+        if self.sprite is None or not self.sprite.alive():
+            return
+        self.tick_actions |= 1 << action
+
+        if action == FORWARD:
             self.sprite.move(move_direction='forward')
-        if keys[K_s]:
+        elif action == REVERSE:
             self.sprite.move(move_direction='reverse')
+        elif action == CLOCKWISE:
+            self.sprite.rotate90(rotation='clockwise')
+        elif action == ANTICLOCKWISE:
+            self.sprite.rotate90(rotation='anticlockwise')
+        elif action == FIRE:
+            self.sprite.fire()
+
+    def act_mask(self, mask):
+        # Apply every action whose bit is set in mask, always in the order of ACTIONS so that replaying
+        # the mask of a tick reproduces it exactly
+        for action in ACTIONS:
+            if mask & (1 << action):
+                self.act(action)
+
+    def take_action(self, keys=(), events=()):
+        # Called once per frame by the interactive game loop
+        pass
+
+
+class HumanAgent(Agent):
+    def take_action(self, keys=(), events=()):
+        # Check what keys are pressed, take an action accordingly (headless games have no keyboard)
+        mask = 0
+        if keys and keys[K_w]:
+            mask |= 1 << FORWARD
+        if keys and keys[K_s]:
+            mask |= 1 << REVERSE
 
         for event in events:
             if event.type == KEYDOWN and event.key == K_a:
-                self.sprite.rotate90(rotation='clockwise')
+                mask |= 1 << CLOCKWISE
             elif event.type == KEYDOWN and event.key == K_d:
-                self.sprite.rotate90(rotation='anticlockwise')
+                mask |= 1 << ANTICLOCKWISE
             elif event.type == KEYDOWN and event.key == K_SPACE:
-                self.sprite.fire()
+                mask |= 1 << FIRE
 
+        self.act_mask(mask)
 
-class RLAgent:
+
+class RLAgent(Agent):
+    # Takes next_action on every tick. A learned policy shouldn't be evaluated once per agent per tick:
+    # game_batch.PolicyBatcher gathers the observations of the RLAgents of many games, calls the policy
+    # once for all of them and fills in their next_action before the games tick.
     def __init__(self, name, game_obj):
-        self.name = name
-        self.game = game_obj
-        self.sprite = None
-        self.score = 0
+        Agent.__init__(self, name, game_obj)
+        self.next_action = NOOP
 
-    def take_action(self, **kwargs):
-        pass
+    def take_action(self, keys=(), events=()):
+        self.act(self.next_action)
+
+
+# Discretization of game_observations.FeatureObserver rows for QLearningAgent. The offset to the other
+# tank is bucketed per axis at these fractions of the canvas, symmetric around zero.
+OFFSET_EDGES = (-0.25, -0.08, -0.02, 0.02, 0.08, 0.25)
+OFFSET_RESOLUTION = 1024
+OFFSET_BINS = len(OFFSET_EDGES) + 1
+HEADINGS = 4
+# No threat, or the side (up, left, down, right) an enemy projectile is coming from
+THREATS = 5
+NUM_STATES = OFFSET_BINS * OFFSET_BINS * HEADINGS * HEADINGS * THREATS
+
+# Bucket of every offset quantized to 1 / OFFSET_RESOLUTION of the canvas, from -1 to 1
+_OFFSET_BUCKETS = np.searchsorted(np.array(OFFSET_EDGES),
+                                  np.arange(-OFFSET_RESOLUTION, OFFSET_RESOLUTION + 1) / float(OFFSET_RESOLUTION),
+                                  side='right').astype(np.intp)
+
+
+def _offset_bucket(offsets):
+    quantized = np.rint(np.asarray(offsets) * OFFSET_RESOLUTION).astype(np.intp)
+    return _OFFSET_BUCKETS[np.clip(quantized, -OFFSET_RESOLUTION, OFFSET_RESOLUTION) + OFFSET_RESOLUTION]
+
+
+def state_indices(features, lane=0.04):
+    # Index into the Q-table of every row of FeatureObserver features (two tanks): offset to the other tank,
+    # both headings and the nearest enemy projectile flying at the own tank within `lane` of its center
+    features = np.asarray(features, dtype=np.float32)
+    features = features.reshape(-1, features.shape[-1])
+    dx_bucket = _offset_bucket(features[:, 7])
+    dy_bucket = _offset_bucket(features[:, 8])
+    own_heading = features[:, 2:6].argmax(axis=1)
+    other_heading = features[:, 9:13].argmax(axis=1)
+
+    threats = features[:, 14:].reshape(len(features), -1, 6)
+    dx, dy, vx, vy = threats[:, :, 0], threats[:, :, 1], threats[:, :, 2], threats[:, :, 3]
+    enemy = (threats[:, :, 4] == 0) & (threats[:, :, 5] == 1)
+    from_up = enemy & (vy > 0) & (dy < 0) & (np.abs(dx) < lane)
+    from_left = enemy & (vx > 0) & (dx < 0) & (np.abs(dy) < lane)
+    from_down = enemy & (vy < 0) & (dy > 0) & (np.abs(dx) < lane)
+    from_right = enemy & (vx < 0) & (dx > 0) & (np.abs(dy) < lane)
+    sides = np.stack((from_up, from_left, from_down, from_right), axis=2)
+    # The nearest threatening projectile decides; threat slots are sorted nearest first
+    threatening = sides.any(axis=2)
+    nearest = threatening.argmax(axis=1)
+    rows = np.arange(len(features))
+    threat = np.where(threatening[rows, nearest], sides[rows, nearest].argmax(axis=1) + 1, 0)
+
+    index = dx_bucket
+    for value, size in ((dy_bucket, OFFSET_BINS), (own_heading, HEADINGS), (other_heading, HEADINGS),
+                        (threat, THREATS)):
+        index = index * size + value
+    return index
+
+
+class QLearningAgent(RLAgent):
+    # Tabular Q-learning (or SARSA) over the discretized FeatureObserver state, e.g.
+    #
+    #     game = Game(headless=True, observer=FeatureObserver)
+    #     agent = game.player_agents[1] = QLearningAgent('Q-learner', game)
+    #
+    # In a game it picks epsilon-greedy actions on every tick and learns online from the change in its
+    # score, updating the table once per batch_size transitions. For training across many games, use
+    # choose_actions() as the policy of a game_batch.PolicyBatcher (or BatchGame.step_policy) and feed
+    # mini-batches of transitions to learn() or update().
+    def __init__(self, name, game_obj, learning_rate=0.1, discount=0.99, epsilon=0.1, sarsa=False,
+                 batch_size=32, seed=None):
+        RLAgent.__init__(self, name, game_obj)
+        self.learning_rate = learning_rate
+        self.discount = discount
+        self.epsilon = epsilon
+        self.sarsa = sarsa
+        self.batch_size = batch_size
+        self.rng = np.random.RandomState(seed)
+        self.table = np.zeros((NUM_STATES, len(ACTIONS)), dtype=np.float32)
+        self.updates = 0
+
+        # Online learning: the last state, action, score, tank and count of tanks killed in the game, and the
+        # transitions not learnt yet
+        self.observer = None
+        self.last = None
+        self.pending = []
+
+    def choose_actions(self, features):
+        # Epsilon-greedy actions for a batch of FeatureObserver rows
+        return self.choose_state_actions(state_indices(features))
+
+    def choose_state_actions(self, states):
+        actions = self.table[states].argmax(axis=1)
+        explore = self.rng.random_sample(len(actions)) < self.epsilon
+        actions[explore] = self.rng.randint(len(ACTIONS), size=int(explore.sum()))
+        return actions
+
+    def update(self, states, actions, rewards, next_states, dones, next_actions=None):
+        # One TD step for a mini-batch of transitions; returns the mean absolute TD error. The errors of
+        # transitions that hit the same entry of the table are averaged, since they are all taken against its
+        # old value: summing them would step k duplicates k times as far.
+        states, actions, next_states = np.asarray(states), np.asarray(actions), np.asarray(next_states)
+        if self.sarsa:
+            next_values = self.table[next_states, np.asarray(next_actions)]
+        else:
+            next_values = self.table[next_states].max(axis=1)
+        next_values[np.asarray(dones, dtype=bool)] = 0
+        targets = np.asarray(rewards, dtype=np.float32) + self.discount * next_values
+        errors = targets - self.table[states, actions]
+        entries = states * self.table.shape[1] + actions
+        counts = np.bincount(entries)[entries]
+        np.add.at(self.table.reshape(-1), entries, self.learning_rate * errors / counts)
+        self.updates += len(errors)
+        return float(np.abs(errors).mean()) if len(errors) else 0.0
+
+    def learn(self, features, actions, rewards, next_features, dones, next_actions=None):
+        return self.update(state_indices(features), actions, rewards, state_indices(next_features), dones,
+                           next_actions)
+
+    def _features(self):
+        from game_observations import FeatureObserver
+
+        if isinstance(self.game.observer, FeatureObserver):
+            observer = self.game.observer
+        else:
+            if self.observer is None:
+                self.observer = FeatureObserver(self.game)
+            observer = self.observer
+        return observer.observe()[self.game.player_agents.index(self)]
+
+    def take_action(self, keys=(), events=()):
+        if self.sprite is None or not self.sprite.alive():
+            return
+        state = int(state_indices(self._features()[None])[0])
+        action = int(self.choose_state_actions(np.array([state]))[0])
+
+        # The previous transition ends in this state, or ended the round if this is a new tank. Only a round
+        # that ended in a hit is terminal; one that was cut off at max_round_steps (or quit) went on past a
+        # state that was never observed, so its last transition is dropped rather than learnt as terminal.
+        if self.last is not None:
+            last_state, last_action, last_score, last_sprite, last_kills = self.last
+            done = last_sprite is not self.sprite
+            if not done or self.game.tanks_killed != last_kills:
+                self.pending.append((last_state, last_action, self.score - last_score, state, done, action))
+            if len(self.pending) >= self.batch_size:
+                self.update(*zip(*self.pending))
+                self.pending = []
+        self.last = state, action, self.score, self.sprite, self.game.tanks_killed
+
+        self.next_action = action
+        RLAgent.take_action(self, keys=keys, events=events)
+
+    def get_params(self):
+        return {'table': self.table}
+
+    def set_params(self, params):
+        self.table = np.array(params['table'], dtype=np.float32)
+
+    def save(self, path):
+        # float16 halves the file; Q-values don't need more precision than that to pick actions
+        np.savez_compressed(path, table=self.table.astype(np.float16), updates=self.updates)
+
+    def load(self, path):
+        with np.load(path) as data:
+            self.table = data['table'].astype(np.float32)
+            self.updates = int(data['updates'])
@@ -0,0 +1,283 @@
+import numpy as np
+
+from game_agents import ACTIONS, FORWARD, REVERSE, CLOCKWISE, ANTICLOCKWISE, FIRE, RLAgent
+from game_objects import (TANK_SIZE, TANK_SPEED, PROJECTILE_SIZE, PROJECTILE_SPEED, MUZZLE_OFFSET,
+                          HIT_REWARD, FRIENDLY_FIRE_PENALTY)
+from game_sim import spawn_points
+
+NUM_PLAYERS = 2
+
+# Unit vector of the "forward" direction for each heading, indexed by direction // 90
+FORWARD_X = np.array([0, -1, 0, 1], dtype=np.int16)
+FORWARD_Y = np.array([-1, 0, 1, 0], dtype=np.int16)
+
+# Offset of the projectile's center from the tank's top-left: the midtop/midleft/midbottom/midright
+# of the tank used by Tank.fire(), pushed MUZZLE_OFFSET further out as in ProjectileStore.spawn()
+MUZZLE_X = np.array([TANK_SIZE // 2, 0, TANK_SIZE // 2, TANK_SIZE], dtype=np.int16) + MUZZLE_OFFSET * FORWARD_X
+MUZZLE_Y = np.array([0, TANK_SIZE // 2, TANK_SIZE, TANK_SIZE // 2], dtype=np.int16) + MUZZLE_OFFSET * FORWARD_Y
+
+
+def random_batch_policy(observations):
+    # Batched policies map an array of observations (one per row) to an array with one action per row
+    return np.random.randint(len(ACTIONS), size=len(observations))
+
+
+def _overlap(a, b, size_a, size_b):
+    # Interval overlap test of Rect.colliderect() along one axis, b < a + size_a and a < b + size_b,
+    # folded into a single unsigned comparison
+    return (a - b + (size_a - 1)).view(np.uint16) < size_a + size_b - 1
+
+
+class BatchGame:
+    # Steps num_games independent arenas in lock-step, with the whole state held in NumPy arrays.
+    #
+    # The rules are the same as Tank.move, Tank.fire and ProjectileStore.update: tanks move
+    # TANK_SPEED pixels per step and stay inside the canvas, projectiles spawn just outside the muzzle and
+    # travel PROJECTILE_SPEED pixels per step, and the first projectile (in firing order) that touches a
+    # tank ends the round. Arenas whose round is over are reset automatically at the end of step().
+    def __init__(self, num_games, length=800, width=800, max_round_steps=None):
+        self.num_games = num_games
+        self.canvas_length = length
+        self.canvas_width = width
+        self.max_round_steps = max_round_steps
+
+        # A projectile lives for at most one step per PROJECTILE_SPEED pixels of canvas, plus the step in
+        # which it touches the edge and the one in which it is killed. Each player fires at most once per
+        # step, so this many slots per arena can never overflow.
+        self.max_projectiles = NUM_PLAYERS * (max(length, width) // PROJECTILE_SPEED + 3)
+
+        n, p = num_games, self.max_projectiles
+        self.tank_x = np.zeros((n, NUM_PLAYERS), dtype=np.int16)
+        self.tank_y = np.zeros((n, NUM_PLAYERS), dtype=np.int16)
+        self.tank_dir = np.zeros((n, NUM_PLAYERS), dtype=np.int16)         # direction // 90
+        self.tank_alive = np.zeros((n, NUM_PLAYERS), dtype=bool)
+
+        # Projectile slots are handed out lowest-free-first, so the live ones are always packed into the
+        # first self.active_slots rows and the per-step work only looks at those. The arrays are shaped
+        # (slots, games) so that those rows are contiguous in memory.
+        self.proj_x = np.zeros((p, n), dtype=np.int16)
+        self.proj_y = np.zeros((p, n), dtype=np.int16)
+        self.proj_vx = np.zeros((p, n), dtype=np.int16)
+        self.proj_vy = np.zeros((p, n), dtype=np.int16)
+        self.proj_dir = np.zeros((p, n), dtype=np.int8)
+        self.proj_owner = np.zeros((p, n), dtype=np.int8)
+        self.proj_alive = np.zeros((p, n), dtype=bool)
+        self.proj_touched_edge = np.zeros((p, n), dtype=bool)
+        self.proj_order = np.zeros((p, n), dtype=np.int64)                 # firing order within the round
+        self.active_slots = 0
+
+        self.scores = np.zeros((n, NUM_PLAYERS), dtype=np.int64)
+        self.round_steps = np.zeros(n, dtype=np.int64)
+        self._shots_fired = np.zeros(n, dtype=np.int64)
+
+        spawns = spawn_points(length, width)
+        self._spawn_x = np.array([x for x, y, direction in spawns], dtype=np.int32)
+        self._spawn_y = np.array([y for x, y, direction in spawns], dtype=np.int32)
+        self._spawn_dir = np.array([direction // 90 for x, y, direction in spawns], dtype=np.int32)
+
+    def reset(self, arenas=None):
+        # Start a new round in the given arenas (all of them by default) and return the observations
+        if arenas is None:
+            arenas = slice(None)
+
+        self.tank_x[arenas] = self._spawn_x
+        self.tank_y[arenas] = self._spawn_y
+        self.tank_dir[arenas] = self._spawn_dir
+        self.tank_alive[arenas] = True
+        self.proj_alive[:, arenas] = False
+        self.proj_touched_edge[:, arenas] = False
+        self.round_steps[arenas] = 0
+        self._shots_fired[arenas] = 0
+
+        return self.get_observations()
+
+    def get_observations(self):
+        # Same layout as Game.observe(): (x, y, direction) of the own tank followed by the other tank,
+        # shaped (num_games, NUM_PLAYERS, 3 * NUM_PLAYERS)
+        tanks = np.stack((self.tank_x, self.tank_y, 90 * self.tank_dir), axis=2)
+        return np.concatenate((tanks, tanks[:, ::-1]), axis=2)
+
+    def step(self, actions):
+        # actions is an integer array shaped (num_games, NUM_PLAYERS) of game_agents.ACTIONS
+        actions = np.asarray(actions)
+        scores = self.scores.copy()
+
+        self._move_tanks(actions)
+        self._rotate_tanks(actions)
+        for player in range(NUM_PLAYERS):
+            self._fire(player, (actions[:, player] == FIRE) & self.tank_alive[:, player])
+
+        self._update_projectiles()
+        self.round_steps += 1
+
+        rewards = self.scores - scores
+        round_over = ~self.tank_alive.any(axis=1)
+        if self.max_round_steps is None:
+            truncated = np.zeros_like(round_over)
+        else:
+            truncated = ~round_over & (self.round_steps >= self.max_round_steps)
+        dones = round_over | truncated
+        info = {'round_steps': self.round_steps.copy(), 'truncated': truncated}
+
+        if dones.any():
+            self.reset(np.flatnonzero(dones))
+
+        return self.get_observations(), rewards, dones, info
+
+    def step_policy(self, policy, observations):
+        # Step every arena with the actions of one batched policy call over all the players of all the
+        # arenas, given the observations returned by the last reset() or step(). The actions are added to info.
+        flat = observations.reshape((-1,) + observations.shape[2:])
+        actions = np.asarray(policy(flat)).reshape(self.num_games, NUM_PLAYERS)
+        observations, rewards, dones, info = self.step(actions)
+        info['actions'] = actions
+        return observations, rewards, dones, info
+
+    def _move_tanks(self, actions):
+        sign = (actions == FORWARD).astype(np.int16) - (actions == REVERSE)
+        sign *= TANK_SPEED * self.tank_alive
+        step_x = sign * FORWARD_X[self.tank_dir]
+        step_y = sign * FORWARD_Y[self.tank_dir]
+
+        # Only move the tanks that are still completely inside the canvas
+        new_x, new_y = self.tank_x + step_x, self.tank_y + step_y
+        inside = ((new_x >= 0) & (new_x + TANK_SIZE <= self.canvas_length) &
+                  (new_y >= 0) & (new_y + TANK_SIZE <= self.canvas_width))
+        self.tank_x += step_x * inside
+        self.tank_y += step_y * inside
+
+    def _rotate_tanks(self, actions):
+        turn = (actions == CLOCKWISE).astype(np.int16) - (actions == ANTICLOCKWISE)
+        self.tank_dir += turn * self.tank_alive
+        self.tank_dir %= 4
+
+    def _fire(self, player, firing):
+        arenas = np.flatnonzero(firing)
+        if len(arenas) == 0:
+            return
+
+        # Lowest free slot of each firing arena; there is always one just past the live rows
+        slots = np.argmin(self.proj_alive[:self.active_slots + 1, arenas], axis=0)
+        direction = self.tank_dir[arenas, player]
+
+        self.proj_x[slots, arenas] = self.tank_x[arenas, player] + MUZZLE_X[direction] - PROJECTILE_SIZE // 2
+        self.proj_y[slots, arenas] = self.tank_y[arenas, player] + MUZZLE_Y[direction] - PROJECTILE_SIZE // 2
+        self.proj_vx[slots, arenas] = PROJECTILE_SPEED * FORWARD_X[direction]
+        self.proj_vy[slots, arenas] = PROJECTILE_SPEED * FORWARD_Y[direction]
+        self.proj_dir[slots, arenas] = direction
+        self.proj_owner[slots, arenas] = player
+        self.proj_alive[slots, arenas] = True
+        self.proj_touched_edge[slots, arenas] = False
+        self.proj_order[slots, arenas] = self._shots_fired[arenas]
+        self._shots_fired[arenas] += 1
+
+        self.active_slots = max(self.active_slots, slots.max() + 1)
+
+    def _update_projectiles(self):
+        k = self.active_slots
+        if k == 0:
+            return
+
+        alive = self.proj_alive[:k]
+        proj_x, proj_y = self.proj_x[:k], self.proj_y[:k]
+
+        # Rect.colliderect() of every live projectile with every live tank
+        hits = []
+        for player in range(NUM_PLAYERS):
+            hit = alive & self.tank_alive[:, player]
+            hit &= _overlap(self.tank_x[:, player].copy(), proj_x, TANK_SIZE, PROJECTILE_SIZE)
+            hit &= _overlap(self.tank_y[:, player].copy(), proj_y, TANK_SIZE, PROJECTILE_SIZE)
+            hits.append(hit)
+        hit_any = np.logical_or.reduce(hits)
+
+        # Only the earliest fired projectile scores: it kills every tank, so later ones find nothing to hit
+        scoring = np.zeros_like(alive)
+        arenas = np.flatnonzero(hit_any.any(axis=0))
+        if len(arenas):
+            order = np.where(hit_any[:, arenas], self.proj_order[:k, arenas], np.iinfo(np.int64).max)
+            slots = np.argmin(order, axis=0)
+            scoring[slots, arenas] = True
+
+            owner = self.proj_owner[slots, arenas]
+            for player in range(NUM_PLAYERS):
+                tank_hit = hits[player][slots, arenas]
+                delta = np.where(owner == player, -FRIENDLY_FIRE_PENALTY, HIT_REWARD) * tank_hit
+                self.scores[arenas, owner] += delta
+            self.tank_alive[arenas] = False
+
+        # Projectiles that touched the edge last step or scored now are killed, the rest move on
+        touched_edge = self.proj_touched_edge[:k]
+        moving = alive & ~(touched_edge | scoring)
+        step_x, step_y = self.proj_vx[:k], self.proj_vy[:k]
+        new_x, new_y = proj_x + step_x, proj_y + step_y
+        inside = ((new_x >= 0) & (new_x + PROJECTILE_SIZE <= self.canvas_length) &
+                  (new_y >= 0) & (new_y + PROJECTILE_SIZE <= self.canvas_width))
+
+        moved = moving & inside
+        proj_x += step_x * moved
+        proj_y += step_y * moved
+        touched_edge |= moving & ~inside
+        alive[...] = moving
+
+        # Shrink the live rows once the projectiles at the end have expired
+        live_rows = np.flatnonzero(moving.any(axis=1))
+        self.active_slots = live_rows[-1] + 1 if len(live_rows) else 0
+
+
+class PolicyBatcher:
+    # Drives the RLAgents of many Game instances (e.g. headless training games, or a window next to
+    # them) with one call of a batched policy per tick instead of one per agent, e.g.
+    #
+    #     batcher = PolicyBatcher([Game(headless=True, max_round_steps=2000) for _ in range(256)], policy)
+    #     while training:
+    #         batcher.tick()
+    #
+    # Every tick gathers the observations of all the RLAgents into one array, calls the policy on it and
+    # scatters the actions back into the agents' next_action before ticking the games. Other agents (e.g.
+    # a HumanAgent) keep reading the input passed to tick(), and RLAgents that pick their own actions in
+    # take_action() (e.g. a QLearningAgent) are left to do so. Games that haven't started a round yet
+    # start one on the first tick, and rounds that are over, or have lasted max_round_steps, are restarted.
+    def __init__(self, games, policy=random_batch_policy):
+        self.games = list(games)
+        self.policy = policy
+        self.agents = [(g, i, agent) for g, game in enumerate(self.games)
+                       for i, agent in enumerate(game.player_agents)
+                       if isinstance(agent, RLAgent) and type(agent).take_action is RLAgent.take_action]
+
+        # Gathered observations, allocated on the first tick once their shape is known
+        self.observations = None
+
+    def start(self):
+        for game in self.games:
+            game.start_round()
+
+    def gather(self):
+        all_observations = [game.get_observations() for game in self.games]
+        if self.observations is None:
+            first = np.asarray(all_observations[0][self.agents[0][1]])
+            self.observations = np.empty((len(self.agents),) + first.shape, dtype=first.dtype)
+
+        observations = self.observations
+        for row, (g, i, agent) in enumerate(self.agents):
+            observations[row] = all_observations[g][i]
+        return observations
+
+    def tick(self, keys=(), events=()):
+        # Advance every game by one tick and return the actions the RLAgents took
+        for game in self.games:
+            if not game.all_player_sprites:
+                game.start_round()
+
+        if not self.agents:
+            actions = ()
+        else:
+            actions = np.asarray(self.policy(self.gather())).tolist()
+            for (g, i, agent), action in zip(self.agents, actions):
+                agent.next_action = action
+
+        for game in self.games:
+            game.tick(keys=keys, events=events)
+            if not game.round_not_over:
+                game.start_round()
+
+        return actions
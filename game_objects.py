@@ -1,26 +1,43 @@
 import pygame
-from utils import load_image
+from lib import hudlight
+from utils import load_image, load_rotations
+
+# Rules of the game, shared by the sprites and the vectorized engine in game_batch
+TANK_SIZE = 32
+TANK_SPEED = 1
+PROJECTILE_SIZE = 4
+PROJECTILE_SPEED = 10
+MUZZLE_OFFSET = 4
+HIT_REWARD = 1
+FRIENDLY_FIRE_PENALTY = 2
+
+# Unit vector of the "forward" direction for each heading
+FORWARD_UNIT = {0: (0, -1), 90: (-1, 0), 180: (0, 1), 270: (1, 0)}
 
 
 class Tank(pygame.sprite.Sprite):
     def __init__(self, game_obj, image_name, init_direction, agent, x, y):
         pygame.sprite.Sprite.__init__(self)  # call Sprite initializer
 
-        self.image, self.rect = load_image(name=image_name, scale_x=32, scale_y=32)
+        # All four rotations of the image come precomputed from the shared asset cache
+        self.images = load_rotations(name=image_name, scale_x=TANK_SIZE, scale_y=TANK_SIZE)
+        self.original = self.images[0]
+        self.rect = self.original.get_rect()
 
         self.game = game_obj
         self.direction = init_direction
         self.rect.topleft = x, y
 
-        self.original = self.image
         self.area = self.game.screen.get_rect()
 
         # Save the self-reference into agent that controls this tank
         self.agent = agent
         self.agent.sprite = self
 
-        rotate = pygame.transform.rotate
-        self.image = rotate(self.original, self.direction)
+        self.image = self.images[self.direction]
+
+        # Register the tank with the game's spatial index so that projectiles only test nearby tanks
+        self.game.grid.insert(self, self.rect)
 
     def rotate90(self, rotation):
         if rotation >= 'clockwise':
@@ -37,14 +54,13 @@ class Tank(pygame.sprite.Sprite):
                 self.image = self.original
             elif self.direction < 0:
                 self.direction += 360
-        rotate = pygame.transform.rotate
-        self.image = rotate(self.original, self.direction)
+        self.image = self.images[self.direction]
 
     def move(self, move_direction):
         # If the direction which it is being moved in is 'forward', depending upon the
         new_pos = None
-        forward_move_dir = {0: (0, -1), 90: (-1, 0), 180: (0, 1), 270: (1, 0)}
-        reverse_move_dir = {0: (0, 1), 90: (1, 0), 180: (0, -1), 270: (-1, 0)}
+        forward_move_dir = {0: (0, -TANK_SPEED), 90: (-TANK_SPEED, 0), 180: (0, TANK_SPEED), 270: (TANK_SPEED, 0)}
+        reverse_move_dir = {0: (0, TANK_SPEED), 90: (TANK_SPEED, 0), 180: (0, -TANK_SPEED), 270: (-TANK_SPEED, 0)}
 
         if move_direction == 'forward':
             new_pos = self.rect.move(forward_move_dir[self.direction])
@@ -54,62 +70,156 @@ class Tank(pygame.sprite.Sprite):
         # If tank's new position is still in the canvas, move the tank
         if self.area.contains(new_pos):
             self.rect = new_pos
+            self.game.grid.move(self, self.rect)
 
     def fire(self):
         fire_actions_dir = {0: self.rect.midtop, 90: self.rect.midleft,
                             180: self.rect.midbottom, 270: self.rect.midright}
 
-        # Create a projectile at the tip, and append it to the game's sprite list
+        # Create a projectile at the tip, in a free slot of the game's projectile store
         proj_x, proj_y = fire_actions_dir[self.direction]
 
-        projectile = Projectile(game_obj=self.game, start_x=proj_x, start_y=proj_y, move_direction=self.direction)
-        projectile.agent = self.agent
-
-        self.game.all_projectile_sprites.add(projectile)
+        self.game.all_projectile_sprites.spawn(start_x=proj_x, start_y=proj_y, move_direction=self.direction,
+                                               agent=self.agent)
 
     def update(self):
         # Move the control logic to the agent's take_action() method
         pass
 
+    def kill(self):
+        self.game.grid.remove(self)
+        self.game.tanks_killed += 1
+        pygame.sprite.Sprite.kill(self)
 
-class Projectile(pygame.sprite.Sprite):
-    def __init__(self, game_obj, start_x, start_y, move_direction):
-        pygame.sprite.Sprite.__init__(self)  # call Sprite initializer
-        init_position_dir = {0: (start_x, start_y - 4), 90: (start_x - 4, start_y),
-                             180: (start_x, start_y + 4), 270: (start_x + 4, start_y)}
 
+class ProjectileStore:
+    # All the live projectiles of a game, kept in fixed-capacity arrays with one slot per projectile instead
+    # of one Sprite per shot. Expired slots go back on a free-list and are recycled by the next shot.
+    # It stands in for the projectile sprite group: update() moves, collides and expires every projectile
+    # in one pass and draw() blits them all onto a surface.
+    def __init__(self, game_obj, capacity=64):
         self.game = game_obj
-        self.image, self.rect = load_image(name='images/projectile.bmp', scale_x=4, scale_y=4)
+        self.image, rect = load_image(name='images/projectile.bmp', scale_x=PROJECTILE_SIZE,
+                                      scale_y=PROJECTILE_SIZE)
         self.area = self.game.screen.get_rect()
 
-        self.direction = move_direction
-
-        # Placeholder for the agent that is going to control this tank
-        self.agent = None
-
-        self.rect.center = init_position_dir[self.direction]
-
-        self.touched_to_edge = False
-
-    def move(self):
-        move_direction_dir = {0: (0, -10), 90: (-10, 0), 180: (0, 10), 270: (10, 0)}
-
-        new_pos = self.rect.move(move_direction_dir[self.direction])
-
-        if self.area.contains(new_pos):
-            self.rect = new_pos
-        else:
-            self.touched_to_edge = True
+        # Top-left corner, velocity and heading of the projectile in each slot, and the agent that fired it
+        self.capacity = 0
+        self.x = []
+        self.y = []
+        self.vx = []
+        self.vy = []
+        self.direction = []
+        self.touched_to_edge = []
+        self.agents = []
+
+        # Slots of the live projectiles in firing order, and the slots that are free to be reused
+        self.live = []
+        self.free = []
+
+        # Where the projectiles were blitted by the last draw(), for erasing them again
+        self.drawn_rects = []
+
+        # Running totals for the profiler (see game_profiler)
+        self.spawned = 0
+        self.expired = 0
+        self.collisions_tested = 0
+
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        for slots in (self.x, self.y, self.vx, self.vy, self.direction):
+            slots.extend([0] * extra)
+        self.touched_to_edge.extend([False] * extra)
+        self.agents.extend([None] * extra)
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def __len__(self):
+        return len(self.live)
+
+    def spawn(self, start_x, start_y, move_direction, agent):
+        if not self.free:
+            self._grow(2 * self.capacity)
+        slot = self.free.pop()
+
+        # Center the projectile just outside the muzzle
+        unit_x, unit_y = FORWARD_UNIT[move_direction]
+        self.x[slot] = start_x + MUZZLE_OFFSET * unit_x - PROJECTILE_SIZE // 2
+        self.y[slot] = start_y + MUZZLE_OFFSET * unit_y - PROJECTILE_SIZE // 2
+        self.vx[slot] = PROJECTILE_SPEED * unit_x
+        self.vy[slot] = PROJECTILE_SPEED * unit_y
+        self.direction[slot] = move_direction
+        self.touched_to_edge[slot] = False
+        self.agents[slot] = agent
+
+        self.live.append(slot)
+        self.spawned += 1
+
+    def empty(self):
+        for slot in self.live:
+            self.agents[slot] = None
+        self.free.extend(self.live)
+        self.live = []
 
     def update(self):
-        tanks_hit = pygame.sprite.spritecollide(sprite=self, group=self.game.all_player_sprites, dokill=False)
+        if not self.live:
+            return
+
+        x, y, vx, vy = self.x, self.y, self.vx, self.vy
+        touched_to_edge = self.touched_to_edge
+        left, top = self.area.left, self.area.top
+        right, bottom = self.area.right - PROJECTILE_SIZE, self.area.bottom - PROJECTILE_SIZE
+
+        # Only the tanks registered in the projectile's grid cell can possibly be hit by it. Shots fired from
+        # the edge of the arena start just outside it, so the cell is clamped like SpatialGrid.query_point()
+        # does.
+        grid = self.game.grid
+        cells, cell_size, columns = grid.cells, grid.cell_size, grid.columns
+        last_column, last_row = columns - 1, grid.rows - 1
+
+        live = []
+        tested = 0
+        for slot in self.live:
+            proj_x, proj_y = x[slot], y[slot]
+
+            hit = False
+            column, row = proj_x // cell_size, proj_y // cell_size
+            if not (0 <= column <= last_column and 0 <= row <= last_row):
+                column, row = min(max(column, 0), last_column), min(max(row, 0), last_row)
+            nearby = cells[row * columns + column]
+            if nearby:
+                tested += len(nearby)
+                projectile_rect = (proj_x, proj_y, PROJECTILE_SIZE, PROJECTILE_SIZE)
+                tanks_hit = [tank for tank in nearby if tank.rect.colliderect(projectile_rect)]
+                if tanks_hit:
+                    hit = True
+                    self._hit(self.agents[slot], tanks_hit)
+
+            if hit or touched_to_edge[slot]:
+                self.agents[slot] = None
+                self.free.append(slot)
+                continue
+
+            new_x, new_y = proj_x + vx[slot], proj_y + vy[slot]
+            if left <= new_x <= right and top <= new_y <= bottom:
+                x[slot], y[slot] = new_x, new_y
+            else:
+                touched_to_edge[slot] = True
+            live.append(slot)
+
+        self.expired += len(self.live) - len(live)
+        self.collisions_tested += tested
+        self.live = live
 
+    def _hit(self, agent, tanks_hit):
         # If the tank that is hit is enemy, increment the score for each of them
         for tank in tanks_hit:
-            if tank.agent is self.agent:
-                self.agent.score -= 2
+            if tank.agent is agent:
+                agent.score -= FRIENDLY_FIRE_PENALTY
             else:
-                self.agent.score += 1
+                agent.score += HIT_REWARD
             tank.kill()
 
             # TODO: Make round_over True, only if the list self.all_player_sprites contains sprites controlled by the same agent
@@ -120,28 +230,59 @@ class Projectile(pygame.sprite.Sprite):
                 for alive_tank in self.game.all_player_sprites:
                     alive_tank.kill()
 
-        if self.touched_to_edge or len(tanks_hit) > 0:
-            self.kill()
-        else:
-            self.move()
+    def draw(self, surface):
+        image, x, y = self.image, self.x, self.y
+        self.drawn_rects = surface.blits([(image, (x[slot], y[slot])) for slot in self.live])
+        return list(self.drawn_rects)
+
+    def clear(self, surface, background):
+        # Same as Group.clear(): blit the background over the projectiles drawn last time
+        cleared = self.drawn_rects
+        surface.blits([(background, rect, rect) for rect in cleared], doreturn=False)
+        self.drawn_rects = []
+        return cleared
 
 
 class HUD(pygame.sprite.Sprite):
+    # Score of every agent in its own column along the top of the background. Each column is a
+    # lib.hudlight.HUD, so fonts and rendered text come from the pygametext caches and a score is only
+    # re-rendered when it changes.
     def __init__(self, game_obj):
         pygame.sprite.Sprite.__init__(self)  # call Sprite initializer
         self.game = game_obj
 
+        # Strip of the background the HUD is painted on
+        self.rect = pygame.Rect(0, 0, self.game.background.get_width(), 60)
+
+        # Rendering text needs a display, which headless games never open
+        self.columns = []
+        for agent in ([] if self.game.headless else self.game.player_agents):
+            column = hudlight.HUD(fontname=None, fontsize=36, sysfontname=None, color='white')
+            column.add('score', '{}: {}', agent.name, agent.score)
+            self.columns.append(column)
+
+        # Names and scores currently painted, None until the first update
+        self.shown = None
+
     def update(self):
-        self.game.background.fill((0, 0, 0))
+        if self.game.headless:
+            return
+
+        scores = [(agent.name, agent.score) for agent in self.game.player_agents]
+        if scores == self.shown:
+            return
+        self.shown = scores
 
-        font = pygame.font.Font(None, 36)
-        column_width = self.game.background.get_width() / len(self.game.player_agents)
+        self.game.background.fill((0, 0, 0), self.rect)
+        column_width = self.rect.width / len(self.columns)
 
-        for i, agent in enumerate(self.game.player_agents):
-            text = font.render(agent.name + ': ' + str(agent.score), 1, (255, 255, 255))
-            text_pos = text.get_rect(centerx=i*column_width + column_width / 2, centery=30)
+        for i, (column, (name, score)) in enumerate(zip(self.columns, scores)):
+            column.update_item('score', name, score)
 
-            self.game.background.blit(text, text_pos)
+            text = column.items['score'][0]
+            text_pos = text.get_rect(centerx=i*column_width + column_width / 2, centery=self.rect.centery)
+            column.x, column.y = text_pos.topleft
+            column.draw(self.game.background)
 
-        self.game.screen.blit(self.game.background, (0, 0))
-        pygame.display.flip()
+        self.game.screen.blit(self.game.background, self.rect, self.rect)
+        pygame.display.update(self.rect)
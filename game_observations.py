@@ -0,0 +1,262 @@
+import numpy as np
+import pygame
+
+from game_objects import PROJECTILE_SIZE
+
+# ITU-R BT.601 luma weights scaled to 256, so that gray = (77 R + 150 G + 29 B) >> 8 fits in uint16
+GRAY_WEIGHTS = (77, 150, 29)
+
+
+class PixelObserver:
+    # Renders the arena straight into a small offscreen surface at the observation resolution (84x84 by
+    # default) instead of grabbing the full-size screen and scaling it down, so it works the same for
+    # headless games, which never draw their screen.
+    #
+    # The surface's pixels live in a NumPy array (pygame.image.frombuffer shares its memory), so blits land
+    # in the array without a copy or a surface lock. observe() then converts them into one of two
+    # preallocated frames and returns it, and nothing is allocated per step. The returned frame is
+    # overwritten by the observe() after next, so callers that keep frames for longer must copy them.
+    # The feature and occupancy observers below allocate small new arrays on every call instead.
+    def __init__(self, game_obj, width=84, height=84, grayscale=True):
+        self.game = game_obj
+        self.width = width
+        self.height = height
+        self.grayscale = grayscale
+        self.scale_x = width / float(self.game.canvas_length)
+        self.scale_y = height / float(self.game.canvas_width)
+
+        self.pixels = np.zeros((height, width, 4), dtype=np.uint8)
+        self.surface = pygame.image.frombuffer(self.pixels, (width, height), 'RGBX')
+
+        if grayscale:
+            self.frames = np.zeros((2, height, width), dtype=np.uint8)
+            self.gray = np.empty((height, width), dtype=np.uint16)
+            self.channel = np.empty((height, width), dtype=np.uint16)
+        else:
+            self.frames = np.zeros((2, height, width, 3), dtype=np.uint8)
+        self.current = 1
+
+        # Every agent sees the same frame: read-only views that repeat each frame once per agent
+        num_agents = len(self.game.player_agents)
+        self.agent_frames = [np.broadcast_to(frame, (num_agents,) + frame.shape) for frame in self.frames]
+
+        # Scaled copies of the background and of every tank image, made on first use
+        self.background = None
+        self.images = {}
+
+        # Projectiles are a few pixels across in the arena and at most one or two in the observation, so
+        # they are drawn as rectangles of the projectile image's average color
+        store = self.game.all_projectile_sprites
+        self.projectile_color = pygame.transform.average_color(store.image.convert(self.surface))
+        self.projectile_width = max(1, int(round(PROJECTILE_SIZE * self.scale_x)))
+        self.projectile_height = max(1, int(round(PROJECTILE_SIZE * self.scale_y)))
+
+    def _scale(self, image, width, height):
+        return pygame.transform.smoothscale(image.convert(self.surface), (width, height))
+
+    def refresh_background(self):
+        # Call after drawing on the game's background, e.g. the HUD, to show it in the observations
+        self.background = self._scale(self.game.background, self.width, self.height)
+
+    def _tank_image(self, tank):
+        key = id(tank.image)
+        image = self.images.get(key)
+        if image is None:
+            image = self._scale(tank.image, max(1, int(round(tank.rect.width * self.scale_x))),
+                                max(1, int(round(tank.rect.height * self.scale_y))))
+            # Keep the source alive with its scaled copy so that its id can't be reused
+            self.images[key] = image, tank.image
+            return image
+        return image[0]
+
+    def draw(self):
+        if self.background is None:
+            self.refresh_background()
+        surface, scale_x, scale_y = self.surface, self.scale_x, self.scale_y
+
+        surface.blit(self.background, (0, 0))
+        for tank in self.game.all_player_sprites:
+            surface.blit(self._tank_image(tank), (int(tank.rect.x * scale_x), int(tank.rect.y * scale_y)))
+
+        store = self.game.all_projectile_sprites
+        color, width, height = self.projectile_color, self.projectile_width, self.projectile_height
+        for slot in store.live:
+            surface.fill(color, (int(store.x[slot] * scale_x), int(store.y[slot] * scale_y), width, height))
+
+    def observe(self):
+        # Draw the current state into a height x width (x 3 if not grayscale) uint8 frame and return it once
+        # per agent, like every observer (see Game.get_observations)
+        self.draw()
+
+        self.current ^= 1
+        frame = self.frames[self.current]
+        pixels = self.pixels
+
+        if self.grayscale:
+            gray, channel = self.gray, self.channel
+            np.multiply(pixels[:, :, 0], GRAY_WEIGHTS[0], out=gray, dtype=np.uint16)
+            for i in (1, 2):
+                np.multiply(pixels[:, :, i], GRAY_WEIGHTS[i], out=channel, dtype=np.uint16)
+                gray += channel
+            np.right_shift(gray, 8, out=frame, casting='unsafe')
+        else:
+            frame[...] = pixels[:, :, :3]
+
+        return self.agent_frames[self.current]
+
+
+def _game_state(game_obj):
+    # Positions (centers), headings and liveness of every agent's tank, and the live projectiles with the
+    # index of the agent that fired each, as NumPy arrays
+    agents = game_obj.player_agents
+    tanks = [agent.sprite for agent in agents]
+    tank_x = np.array([tank.rect.centerx for tank in tanks], dtype=np.float32)
+    tank_y = np.array([tank.rect.centery for tank in tanks], dtype=np.float32)
+    tank_dir = np.array([tank.direction // 90 for tank in tanks], dtype=np.intp)
+    tank_alive = np.array([tank.alive() for tank in tanks], dtype=bool)
+
+    store = game_obj.all_projectile_sprites
+    live = store.live
+    owners = dict((agent, i) for i, agent in enumerate(agents))
+    proj_x = np.array([store.x[slot] for slot in live], dtype=np.float32) + PROJECTILE_SIZE / 2.0
+    proj_y = np.array([store.y[slot] for slot in live], dtype=np.float32) + PROJECTILE_SIZE / 2.0
+    proj_vx = np.array([store.vx[slot] for slot in live], dtype=np.float32)
+    proj_vy = np.array([store.vy[slot] for slot in live], dtype=np.float32)
+    proj_owner = np.array([owners.get(store.agents[slot], -1) for slot in live], dtype=np.intp)
+
+    return tank_x, tank_y, tank_dir, tank_alive, proj_x, proj_y, proj_vx, proj_vy, proj_owner
+
+
+class FeatureObserver:
+    # Fixed-length feature vector per agent, computed from the game state without drawing anything.
+    # Row i of observe() is agent i's view, with positions relative to its own tank:
+    #
+    #   own tank        x, y (as fractions of the canvas), heading one-hot (4), alive
+    #   other tanks     dx, dy (as fractions of the canvas), heading one-hot (4), alive; in agent order
+    #   threats         dx, dy, vx, vy (as fractions of the projectile speed), fired by this agent, present;
+    #                   the max_threats projectiles closest to the own tank, nearest first
+    #
+    # Missing threats are all zeros.
+    TANK_FEATURES = 7
+    THREAT_FEATURES = 6
+
+    def __init__(self, game_obj, max_threats=4):
+        self.game = game_obj
+        self.max_threats = max_threats
+        self.num_agents = len(self.game.player_agents)
+        self.size = self.TANK_FEATURES * self.num_agents + self.THREAT_FEATURES * max_threats
+        self.scale = np.array([self.game.canvas_length, self.game.canvas_width], dtype=np.float32)
+
+        # Row i lists the other agents of agent i in agent order
+        self.others = np.array([[j for j in range(self.num_agents) if j != i] for i in range(self.num_agents)],
+                               dtype=np.intp).reshape(self.num_agents, self.num_agents - 1)
+
+    def observe(self):
+        tank_x, tank_y, tank_dir, tank_alive, proj_x, proj_y, proj_vx, proj_vy, proj_owner = _game_state(self.game)
+        n, length, width = self.num_agents, self.scale[0], self.scale[1]
+        rows = np.arange(n)
+
+        features = np.zeros((n, self.size), dtype=np.float32)
+        tanks = features[:, :self.TANK_FEATURES * n].reshape(n, n, self.TANK_FEATURES)
+
+        # Own tank first, then the others relative to it
+        order = np.concatenate([rows[:, None], self.others], axis=1)
+        tanks[:, :, 0] = tank_x[order]
+        tanks[:, :, 1] = tank_y[order]
+        tanks[:, 1:, 0] -= tank_x[:, None]
+        tanks[:, 1:, 1] -= tank_y[:, None]
+        tanks[:, :, 0] /= length
+        tanks[:, :, 1] /= width
+        tanks[rows[:, None], np.arange(n)[None, :], 2 + tank_dir[order]] = 1
+        tanks[:, :, 6] = tank_alive[order]
+
+        count = min(self.max_threats, len(proj_x))
+        if count:
+            dx = proj_x[None, :] - tank_x[:, None]
+            dy = proj_y[None, :] - tank_y[:, None]
+            nearest = np.argsort(dx * dx + dy * dy, axis=1, kind='stable')[:, :count]
+
+            threats = features[:, self.TANK_FEATURES * n:].reshape(n, self.max_threats, self.THREAT_FEATURES)
+            threats[:, :count, 0] = np.take_along_axis(dx, nearest, axis=1) / length
+            threats[:, :count, 1] = np.take_along_axis(dy, nearest, axis=1) / width
+            speed = float(max(np.abs(proj_vx).max(), np.abs(proj_vy).max(), 1))
+            threats[:, :count, 2] = proj_vx[nearest] / speed
+            threats[:, :count, 3] = proj_vy[nearest] / speed
+            threats[:, :count, 4] = proj_owner[nearest] == rows[:, None]
+            threats[:, :count, 5] = 1
+
+        return features
+
+
+class OccupancyObserver:
+    # Coarse occupancy grid of the whole arena plus an egocentric crop around each tank, computed from the
+    # game state without drawing anything. observe() returns a (grid, crop) pair per agent:
+    #
+    #   grid    CHANNELS x rows x columns uint8, one cell per cell_size x cell_size pixels, with the channels
+    #           own tank, other tanks, own projectiles, other projectiles
+    #   crop    (CHANNELS + 1) x crop_size x crop_size cells of the grid centered on the own tank and rotated
+    #           so that its heading points up, with an extra channel marking cells outside the arena
+    #
+    # The crops of a dead tank are all zeros.
+    CHANNELS = 4
+
+    def __init__(self, game_obj, cell_size=16, crop_size=11):
+        self.game = game_obj
+        self.cell_size = cell_size
+        self.crop_size = crop_size
+        self.num_agents = len(self.game.player_agents)
+        self.rows = (self.game.canvas_width + cell_size - 1) // cell_size
+        self.columns = (self.game.canvas_length + cell_size - 1) // cell_size
+
+        # Per-agent layers of tanks and projectiles, and the grid padded with crop_size // 2 cells of wall on
+        # every side, reused between calls
+        self.tank_layers = np.zeros((self.num_agents, self.rows, self.columns), dtype=np.uint8)
+        self.projectile_layers = np.zeros((self.num_agents, self.rows, self.columns), dtype=np.uint8)
+        pad = crop_size // 2
+        self.padded = np.zeros((self.CHANNELS + 1, self.rows + 2 * pad, self.columns + 2 * pad), dtype=np.uint8)
+        self.padded[self.CHANNELS] = 1
+        self.padded[self.CHANNELS, pad:pad + self.rows, pad:pad + self.columns] = 0
+
+    def observe(self):
+        tank_x, tank_y, tank_dir, tank_alive, proj_x, proj_y, proj_vx, proj_vy, proj_owner = _game_state(self.game)
+        cell_size, n = self.cell_size, self.num_agents
+
+        tank_layers, projectile_layers = self.tank_layers, self.projectile_layers
+        tank_layers.fill(0)
+        projectile_layers.fill(0)
+        for i, agent in enumerate(self.game.player_agents):
+            if tank_alive[i]:
+                rect = agent.sprite.rect
+                tank_layers[i, rect.top // cell_size:(rect.bottom - 1) // cell_size + 1,
+                            rect.left // cell_size:(rect.right - 1) // cell_size + 1] = 1
+
+        # Shots fired from the edge of the arena start just outside it, in no cell at all
+        proj_rows = (proj_y // cell_size).astype(np.intp)
+        proj_columns = (proj_x // cell_size).astype(np.intp)
+        shown = ((proj_owner >= 0) & (proj_rows >= 0) & (proj_rows < self.rows) & (proj_columns >= 0) &
+                 (proj_columns < self.columns))
+        projectile_layers[proj_owner[shown], proj_rows[shown], proj_columns[shown]] = 1
+
+        # A cell holds something of the others when more agents have something there than just oneself
+        grids = np.empty((n, self.CHANNELS, self.rows, self.columns), dtype=np.uint8)
+        grids[:, 0] = tank_layers
+        grids[:, 1] = tank_layers.sum(axis=0, dtype=np.uint8) > tank_layers
+        grids[:, 2] = projectile_layers
+        grids[:, 3] = projectile_layers.sum(axis=0, dtype=np.uint8) > projectile_layers
+
+        crops = np.zeros((n, self.CHANNELS + 1, self.crop_size, self.crop_size), dtype=np.uint8)
+        padded, pad, size = self.padded, self.crop_size // 2, self.crop_size
+        for i in range(n):
+            if not tank_alive[i]:
+                continue
+            padded[:self.CHANNELS, pad:pad + self.rows, pad:pad + self.columns] = grids[i]
+            row, column = int(tank_y[i]) // cell_size, int(tank_x[i]) // cell_size
+            # Headings are counted anticlockwise from up, so undo them with as many clockwise quarter turns
+            crops[i] = np.rot90(padded[:, row:row + size, column:column + size], k=-tank_dir[i], axes=(1, 2))
+
+        return list(zip(grids, crops))
+
+
+# Observers by the names that env_server.py and shared_rollout.py accept from other processes; None stands
+# for the (x, y, direction) tuples of Game.observe()
+OBSERVERS = {None: None, 'features': FeatureObserver, 'occupancy': OccupancyObserver, 'pixels': PixelObserver}
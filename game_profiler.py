@@ -0,0 +1,159 @@
+from timeit import default_timer
+
+import pygame
+
+from lib import hudlight
+
+# Phases of a frame of Game.play_round(), in the order they run
+PHASES = ('input', 'actions', 'players', 'projectiles', 'draw', 'flip')
+
+# Events counted per frame, from the running totals kept by the game and its projectile store
+COUNTERS = ('projectiles_spawned', 'collisions_tested', 'sprites_killed')
+
+# The HUD overlay only re-renders its text this often, so that it doesn't dominate the frames it measures
+HUD_REFRESH_MS = 250
+
+
+class RollingHistogram:
+    # The last `size` samples of a value in a ring, with statistics over them computed on demand. Adding a
+    # sample is O(1); the percentiles sort the window when asked for.
+    def __init__(self, size=300):
+        self.size = size
+        self.samples = [0.0] * size
+        self.count = 0
+
+    def add(self, value):
+        self.samples[self.count % self.size] = value
+        self.count += 1
+
+    def window(self):
+        return self.samples[:self.count] if self.count < self.size else list(self.samples)
+
+    def mean(self):
+        window = self.window()
+        return sum(window) / len(window) if window else 0.0
+
+    def percentile(self, fraction):
+        window = sorted(self.window())
+        if not window:
+            return 0.0
+        return window[min(len(window) - 1, int(fraction * len(window)))]
+
+    def histogram(self, edges):
+        # Number of samples in each of the bins edges[i] <= sample < edges[i + 1]
+        counts = [0] * (len(edges) - 1)
+        for sample in self.window():
+            for i in range(len(counts)):
+                if edges[i] <= sample < edges[i + 1]:
+                    counts[i] += 1
+                    break
+        return counts
+
+    def summary(self):
+        window = sorted(self.window())
+        if not window:
+            return {'mean': 0.0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+        last = len(window) - 1
+        return {'mean': sum(window) / len(window), 'p50': window[min(last, int(0.5 * len(window)))],
+                'p90': window[min(last, int(0.9 * len(window)))], 'p99': window[min(last, int(0.99 * len(window)))],
+                'max': window[-1]}
+
+
+class Profiler:
+    # Per-phase timers and per-frame counters for the game loop, enabled with Game(profile=True). The game
+    # calls lap(phase) at the end of every phase, which charges the time since the previous lap to it. Times
+    # of a phase that runs several times in a frame (e.g. one tick per render with render_every > 1) are
+    # summed. A disabled profiler costs the game one `is not None` test per phase.
+    def __init__(self, game_obj, window=300):
+        self.game = game_obj
+        self.frames = 0
+        self.phases = dict((phase, RollingHistogram(window)) for phase in PHASES)
+        self.counters = dict((counter, RollingHistogram(window)) for counter in COUNTERS)
+
+        self.frame_times = dict((phase, 0.0) for phase in PHASES)
+        self.last = None
+        self.totals = None
+
+        # Optional overlay on the game screen, see attach_hud()
+        self.hud = None
+        self.hud_rect = None
+        self.hud_refreshed = None
+
+    def _totals(self):
+        store = self.game.all_projectile_sprites
+        return store.spawned, store.collisions_tested, self.game.tanks_killed + store.expired
+
+    def begin_frame(self):
+        self.totals = self._totals()
+        self.last = default_timer()
+
+    def lap(self, phase):
+        if self.last is None:
+            return
+        now = default_timer()
+        self.frame_times[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        if self.last is None:
+            return
+        frame_times = self.frame_times
+        for phase in PHASES:
+            self.phases[phase].add(1000.0 * frame_times[phase])
+            frame_times[phase] = 0.0
+
+        for counter, total, previous in zip(COUNTERS, self._totals(), self.totals):
+            self.counters[counter].add(total - previous)
+
+        self.frames += 1
+        self.last = None
+
+    def summary(self):
+        # Statistics of every phase in milliseconds per frame and of every counter per frame
+        result = dict((phase, histogram.summary()) for phase, histogram in self.phases.items())
+        result.update((counter, histogram.summary()) for counter, histogram in self.counters.items())
+        return result
+
+    def report(self):
+        lines = ['%-20s %8s %8s %8s %8s' % ('per frame', 'mean', 'p50', 'p99', 'max')]
+        summary = self.summary()
+        for name in PHASES + COUNTERS:
+            stats = summary[name]
+            unit = ' ms' if name in PHASES else ''
+            lines.append('%-20s %8.3f %8.3f %8.3f %8.3f' % (name + unit, stats['mean'], stats['p50'], stats['p99'],
+                                                             stats['max']))
+        return '\n'.join(lines)
+
+    def attach_hud(self, hud=None):
+        # Show the mean and p99 of every phase and the frame rate in a lib.hudlight.HUD drawn over the game
+        if hud is None:
+            hud = hudlight.HUD(fontname=None, fontsize=20, sysfontname=None, color='yellow', background='black')
+            hud.x, hud.y = 10, 70
+        clock = self.game.clock
+        hud.add('fps', '{:5.1f} fps', 0.0, callback=lambda: round(clock.get_fps(), 1))
+        for phase in PHASES:
+            histogram = self.phases[phase]
+            hud.add(phase, '{:<12} {:6.2f} ms  p99 {:6.2f} ms', phase, 0.0, 0.0,
+                    callback=lambda phase=phase, histogram=histogram:
+                    (phase, round(histogram.mean(), 2), round(histogram.percentile(0.99), 2)))
+        self.hud = hud
+        return hud
+
+    def clear_hud(self, surface, background):
+        # Erase the overlay where it was last drawn, returning that area (or None)
+        rect = self.hud_rect
+        if rect is not None:
+            surface.blit(background, rect, rect)
+            self.hud_rect = None
+        return rect
+
+    def draw_hud(self, surface):
+        # Draw the overlay on top of the frame and return its area
+        now = pygame.time.get_ticks()
+        if self.hud_refreshed is None or now - self.hud_refreshed >= HUD_REFRESH_MS:
+            self.hud.update()
+            self.hud_refreshed = now
+
+        self.hud.draw(surface)
+        self.hud_rect = pygame.Rect((self.hud.x, self.hud.y), self.hud.hud_size())
+        return self.hud_rect
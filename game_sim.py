@@ -1,25 +1,99 @@
+import os
+import random
+import time
+from timeit import default_timer
+
 import pygame
-from game_objects import Tank, HUD
+from game_objects import Tank, ProjectileStore, HUD, PROJECTILE_SIZE
+from game_profiler import Profiler
+from spatial_grid import SpatialGrid
 from game_agents import *
 
 
+def spawn_points(length, width):
+    # Top-left corner and initial heading of each player's tank, in the order of Game.player_agents
+    return [(10, 10, 90), (length - 50, width - 50, 270)]
+
+
+# Whether the display was initialized on SDL's dummy driver for a headless Game
+_dummy_display = False
+
+
+def _init_pygame(headless):
+    global _dummy_display
+    if headless and not pygame.display.get_init():
+        # Make sure SDL doesn't look for a real display on render-less machines, and doesn't turn
+        # SIGINT/SIGTERM into QUIT events nobody polls, so that worker processes running headless games
+        # can still be terminated. SDL only reads these at initialization, so they are set for this call
+        # alone and don't leak into the rest of the process; settings of the user's own are kept.
+        overrides = dict((name, value) for name, value in (('SDL_VIDEODRIVER', 'dummy'),
+                                                           ('SDL_NO_SIGNAL_HANDLERS', '1'))
+                         if name not in os.environ)
+        os.environ.update(overrides)
+        try:
+            pygame.init()
+        finally:
+            for name in overrides:
+                del os.environ[name]
+        _dummy_display = 'SDL_VIDEODRIVER' in overrides
+        return
+
+    if not headless and _dummy_display:
+        # A headless Game came first; open the window on the real display driver
+        pygame.display.quit()
+        _dummy_display = False
+    pygame.init()
+
+
 class Game:
-    def __init__(self, length=800, width=800):
+    def __init__(self, length=800, width=800, headless=False, max_round_steps=None, dirty_rects=True,
+                 tick_rate=60, render_every=1, seed=None, observer=None, profile=False, profile_hud=False):
         # Save the parameters of the simulation
         self.canvas_length = length             # Default is 800
         self.canvas_width = width               # Default is 800
 
-        # Initialize pygame library
-        pygame.init()
+        # Every round gets its own seed, drawn from the game's seed. Anything random in a round must come
+        # from self.rng so that a replay of the round can reproduce it.
+        self.seed = random.SystemRandom().getrandbits(63) if seed is None else seed
+        self.round_seeds = random.Random(self.seed)
+        self.round_seed = None
+        self.rng = None
+
+        # Records the actions of every tick when set, see replay.ReplayRecorder
+        self.recorder = None
+
+        # Rounds are cut off after this many ticks (None means never), however the game is driven
+        self.max_round_steps = max_round_steps
 
-        # Initialize the window, set caption
-        self.screen = pygame.display.set_mode((self.canvas_length, self.canvas_width))
-        pygame.display.set_caption('Reinforcement Learning: Tanks')
+        # Headless games never open a window, poll events, draw or cap the frame rate
+        self.headless = headless
 
-        # Create a new surface to be used as a background for setting caption, HUD and other stuff
-        bg = pygame.Surface(self.screen.get_size())
-        # convert with no arguments will make sure our background is the same format as the display window
-        self.background = bg.convert()
+        # Redraw only the rectangles that changed since the last frame instead of the whole screen
+        self.dirty_rects = dirty_rects
+        self.full_redraw = True
+
+        # play_round() advances the logic at tick_rate ticks per second of wall time (None for as fast as
+        # possible) and renders a frame every render_every ticks (0 for never). E.g. tick_rate=240 with
+        # render_every=4 spectates at four times the normal speed while still showing 60 frames per second.
+        self.tick_rate = tick_rate
+        self.render_every = render_every
+
+        # Initialize pygame library
+        _init_pygame(self.headless)
+
+        if self.headless:
+            # An off-screen surface only provides the arena bounds for the sprites
+            self.screen = pygame.Surface((self.canvas_length, self.canvas_width))
+            self.background = pygame.Surface(self.screen.get_size())
+        else:
+            # Initialize the window, set caption
+            self.screen = pygame.display.set_mode((self.canvas_length, self.canvas_width))
+            pygame.display.set_caption('Reinforcement Learning: Tanks')
+
+            # Create a new surface to be used as a background for setting caption, HUD and other stuff
+            bg = pygame.Surface(self.screen.get_size())
+            # convert with no arguments will make sure our background is the same format as the display window
+            self.background = bg.convert()
         # Set the color as black
         self.background.fill((0, 0, 0))
 
@@ -28,9 +102,13 @@ class Game:
         self.player_agents.append(HumanAgent(name='Human', game_obj=self))
         self.player_agents.append(RLAgent(name='RL Agent', game_obj=self))
 
+        # Spatial index of the tanks (and later walls), sized so that a projectile's top-left corner
+        # is enough to find everything it may collide with
+        self.grid = SpatialGrid(self.canvas_length, self.canvas_width, margin=PROJECTILE_SIZE)
+
         # Create all sprites
-        self.all_player_sprites = pygame.sprite.RenderPlain(())
-        self.all_projectile_sprites = pygame.sprite.RenderPlain(())
+        self.all_player_sprites = pygame.sprite.RenderUpdates(())
+        self.all_projectile_sprites = ProjectileStore(game_obj=self)
 
         # Create an HUD
         self.hud_sprite = HUD(game_obj=self)
@@ -38,43 +116,203 @@ class Game:
         # Create a clock
         self.clock = pygame.time.Clock()
 
-        # Game state variables
+        # What reset() and step() return as observations: a factory such as game_observations.FeatureObserver
+        # that is called with the game, or None for the (x, y, direction) tuples of observe()
+        self.observer = observer(self) if observer is not None else None
+
+        # Per-phase timers and counters of the game loop, with an optional overlay (see game_profiler)
+        self.tanks_killed = 0
+        self.profiler = Profiler(self) if profile or profile_hud else None
+        if profile_hud and not self.headless:
+            self.profiler.attach_hud()
+
+        # Game state variables; a round that ran out of ticks is over and truncated rather than won
         self.round_not_over = True
+        self.round_truncated = False
+        self.round_steps = 0
+
+    def spawn_tanks(self, placements=None):
+        if placements is None:
+            placements = spawn_points(self.canvas_length, self.canvas_width)
+        (x1, y1, direction1), (x2, y2, direction2) = placements
 
-    def start_round(self):
         # Create tank(s) for the human agent
         tank1 = Tank(game_obj=self, image_name='images/tank1.bmp',
-                     init_direction=90, agent=self.player_agents[0],
-                     x=10, y=10)
+                     init_direction=direction1, agent=self.player_agents[0],
+                     x=x1, y=y1)
         self.all_player_sprites.add(tank1)
 
-        # Create tank(s) for the computer agent
+        # Create tank(s) for the computer agent, in the opposite corner of the canvas
         tank2 = Tank(game_obj=self, image_name='images/tank2.bmp',
-                     init_direction=270, agent=self.player_agents[1],
-                     x=750, y=750)
+                     init_direction=direction2, agent=self.player_agents[1],
+                     x=x2, y=y2)
         self.all_player_sprites.add(tank2)
 
+    def start_round(self):
+        # Projectiles still flying at the end of the last round don't carry over into this one
+        self.reset()
+
+        # Update the player sprites and projectiles, on top of the HUD that was drawn in between rounds
+        self.full_redraw = True
+        self.render()
+
+    def update_sprites(self):
         # Call update methods of all the sprites
         self.all_player_sprites.update()
+        if self.profiler is not None:
+            self.profiler.lap('players')
         self.all_projectile_sprites.update()
-
-        # Update the player sprites and projectiles
-        self.screen.blit(self.background, (0, 0))
-        self.all_player_sprites.draw(self.screen)
-        self.all_projectile_sprites.draw(self.screen)
-        pygame.display.flip()
+        if self.profiler is not None:
+            self.profiler.lap('projectiles')
+
+    def tick(self, keys=(), events=()):
+        # Advance the game logic by exactly one step, letting the agents read the input themselves
+        for agent in self.player_agents:
+            agent.take_action(keys=keys, events=events)
+        if self.profiler is not None:
+            self.profiler.lap('actions')
+
+        self.end_tick()
+
+    def observe(self, agent):
+        # Position and heading of the agent's own tank first, followed by the other tanks
+        own = agent.sprite
+        observation = [own.rect.x, own.rect.y, own.direction]
+        for other_agent in self.player_agents:
+            if other_agent is not agent:
+                other = other_agent.sprite
+                observation += [other.rect.x, other.rect.y, other.direction]
+        return tuple(observation)
+
+    def get_observations(self):
+        # One observation per agent, in the order of player_agents
+        if self.observer is not None:
+            return self.observer.observe()
+        return [self.observe(agent) for agent in self.player_agents]
+
+    def end_tick(self):
+        # Hand the actions the agents took during this tick to the recorder, then let the sprites move and
+        # count the tick against max_round_steps
+        if self.recorder is not None:
+            self.recorder.record_tick([agent.tick_actions for agent in self.player_agents])
+        for agent in self.player_agents:
+            agent.tick_actions = 0
+
+        self.update_sprites()
+
+        self.round_steps += 1
+        if self.round_not_over and self.max_round_steps is not None and self.round_steps >= self.max_round_steps:
+            self.round_not_over = False
+            self.round_truncated = True
+
+    def reset(self, placements=None, round_seed=None):
+        # Start a fresh round without any interactive screens, and return the first observations.
+        # Replays pass the tank placements and round seed they recorded.
+        self.all_player_sprites.empty()
+        self.all_projectile_sprites.empty()
+        self.grid.clear()
+        self.spawn_tanks(placements)
+
+        self.round_seed = self.round_seeds.getrandbits(63) if round_seed is None else round_seed
+        self.rng = random.Random(self.round_seed)
 
         self.round_not_over = True
+        self.round_truncated = False
+        self.round_steps = 0
+
+        if self.recorder is not None:
+            self.recorder.begin_round()
+
+        return self.get_observations()
+
+    def step(self, actions):
+        # Apply one action per agent (in the order of self.player_agents) and advance the game by one step
+        scores = [agent.score for agent in self.player_agents]
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_frame()
+
+        for agent, action in zip(self.player_agents, actions):
+            agent.act(action)
+        if profiler is not None:
+            profiler.lap('actions')
+
+        self.end_tick()
+        if profiler is not None:
+            profiler.end_frame()
+
+        # Reward is the change in each agent's score during this step
+        rewards = [agent.score - score for agent, score in zip(self.player_agents, scores)]
+
+        done = not self.round_not_over
+        info = {'round_steps': self.round_steps, 'truncated': self.round_truncated}
+
+        return self.get_observations(), rewards, done, info
+
+    def render(self):
+        if self.headless:
+            return
+
+        # The profiler's overlay, if any, is drawn over everything else
+        profiler = self.profiler
+        overlay = profiler is not None and profiler.hud is not None
+
+        if self.full_redraw or not self.dirty_rects:
+            # Update the player sprites and projectiles
+            self.screen.blit(self.background, (0, 0))
+            self.all_player_sprites.draw(self.screen)
+            self.all_projectile_sprites.draw(self.screen)
+            if overlay:
+                profiler.draw_hud(self.screen)
+            if profiler is not None:
+                profiler.lap('draw')
+            pygame.display.flip()
+            if profiler is not None:
+                profiler.lap('flip')
+            self.full_redraw = False
+            return
+
+        # Erase the sprites where they were drawn last frame, draw them at their new positions and only
+        # push those rectangles to the display
+        self.all_player_sprites.clear(self.screen, self.background)
+        dirty = self.all_projectile_sprites.clear(self.screen, self.background)
+        if overlay and profiler.hud_rect is not None:
+            dirty.append(profiler.clear_hud(self.screen, self.background))
+        dirty += self.all_player_sprites.draw(self.screen)
+        dirty += self.all_projectile_sprites.draw(self.screen)
+        if overlay:
+            dirty.append(profiler.draw_hud(self.screen))
+        if profiler is not None:
+            profiler.lap('draw')
+        pygame.display.update(dirty)
+        if profiler is not None:
+            profiler.lap('flip')
 
     def play_round(self):
         game_running = True
 
+        tick_period = 1.0 / self.tick_rate if self.tick_rate else 0.0
+        ticks_per_frame = self.render_every or 1
+        deadline = default_timer()
+
+        profiler = self.profiler
+
         while self.round_not_over:
-            # This will ensure that the game doesn't run faster than 60 FPS
-            self.clock.tick(60)
+            if profiler is not None:
+                profiler.begin_frame()
+
+            if self.headless:
+                # No window, no input and no frame cap, just run the logic as fast as possible
+                self.tick()
+                if profiler is not None:
+                    profiler.end_frame()
+                continue
 
             keys = pygame.key.get_pressed()
             events = pygame.event.get()
+            if profiler is not None:
+                profiler.lap('input')
 
             # Check for "quit" events
             for event in events:
@@ -85,23 +323,36 @@ class Game:
                     game_running = False
                     self.round_not_over = False
 
-            # Tell agents to take actions
-            for agent in self.player_agents:
-                agent.take_action(keys=keys, events=events)
-
-            # Call update methods of all the sprites
-            self.all_player_sprites.update()
-            self.all_projectile_sprites.update()
-
-            # Update the player sprites and projectiles
-            self.screen.blit(self.background, (0, 0))
-            self.all_player_sprites.draw(self.screen)
-            self.all_projectile_sprites.draw(self.screen)
-            pygame.display.flip()
+            # Tell agents to take actions and update the sprites, once per tick until the next frame. Key
+            # presses only count for the first of those ticks, held keys count for all of them.
+            for _ in range(ticks_per_frame):
+                if not self.round_not_over:
+                    break
+                self.tick(keys=keys, events=events)
+                events = ()
+
+            if self.render_every:
+                self.render()
+                self.clock.tick()
+            if profiler is not None:
+                profiler.end_frame()
+
+            # Wait for the wall time of the ticks that were just simulated, but don't try to catch up when
+            # the loop has fallen behind, e.g. after the window was dragged
+            if tick_period:
+                deadline += ticks_per_frame * tick_period
+                delay = deadline - default_timer()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = default_timer()
 
         return game_running
 
     def show_welcome_screen(self):
+        if self.headless:
+            return
+
         self.background.fill((0, 0, 0))
 
         if pygame.font:
@@ -126,6 +377,9 @@ class Game:
                     self.hud_sprite.update()
 
     def show_winner(self):
+        if self.headless:
+            return
+
         self.background.fill((0, 0, 0))
 
         from operator import attrgetter
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def _parts(observations):
+    # The observations of all agents as arrays with a row per agent: one array, or one per part for
+    # observers whose observations are tuples of arrays (e.g. OccupancyObserver)
+    if isinstance(observations, np.ndarray):
+        return [observations]
+    if isinstance(observations[0], tuple) and isinstance(observations[0][0], np.ndarray):
+        return [np.stack(part) for part in zip(*observations)]
+    return [np.asarray(observations)]
+
+
+class FrameStack:
+    # Wraps the reset()/step() API of a Game so that every agent observes its last num_frames observations
+    # (oldest first) and every action is repeated action_repeat times, e.g.
+    #
+    #     env = FrameStack(Game(headless=True, observer=FeatureObserver), num_frames=4, action_repeat=4)
+    #     observations = env.reset()          # agents x num_frames x observation shape
+    #     observations, rewards, done, info = env.step(actions)
+    #
+    # The observations are kept in a ring buffer that stores every observation twice, num_frames slots
+    # apart, so the last num_frames of them are always one contiguous slice and the stack is returned as a
+    # view instead of being concatenated. The view is only valid until the next step(); copy it to keep it.
+    # Observers whose observations are tuples of arrays get a ring buffer per part and a tuple of stacks.
+    def __init__(self, game_obj, num_frames=4, action_repeat=1):
+        self.game = game_obj
+        self.num_frames = num_frames
+        self.action_repeat = action_repeat
+
+        # One buffer per part, allocated by the first reset(), when the shape of the observations is known
+        self.frames = None
+        self.tuples = False
+        self.position = 0
+
+    @property
+    def player_agents(self):
+        return self.game.player_agents
+
+    def _stacks(self, start):
+        stacks = tuple(frames[:, start:start + self.num_frames] for frames in self.frames)
+        return stacks if self.tuples else stacks[0]
+
+    def _push(self, observations):
+        # Write the newest observation into slot position and its twin num_frames further on, then return
+        # the num_frames slots ending with it
+        self.position = (self.position + 1) % self.num_frames
+        for frames, part in zip(self.frames, _parts(observations)):
+            frames[:, self.position] = part
+            frames[:, self.position + self.num_frames] = part
+        return self._stacks(self.position + 1)
+
+    def reset(self, *args, **kwargs):
+        observations = self.game.reset(*args, **kwargs)
+
+        parts = _parts(observations)
+        self.tuples = len(parts) > 1
+        if (self.frames is None or len(self.frames) != len(parts) or
+                any(frames.shape[2:] != part.shape[1:] or frames.dtype != part.dtype
+                    for frames, part in zip(self.frames, parts))):
+            self.frames = [np.empty((part.shape[0], 2 * self.num_frames) + part.shape[1:], dtype=part.dtype)
+                           for part in parts]
+
+        # The round starts with the first observation repeated over the whole stack
+        for frames, part in zip(self.frames, parts):
+            frames[:] = part[:, None]
+        self.position = 0
+        return self._stacks(1)
+
+    def step(self, actions):
+        # Repeat the actions until action_repeat steps have passed or the round is over. The rewards are
+        # summed over the repeats and info is that of the last step, plus the number of repeats taken.
+        total_rewards = None
+        for repeat in range(self.action_repeat):
+            observations, rewards, done, info = self.game.step(actions)
+            if total_rewards is None:
+                total_rewards = list(rewards)
+            else:
+                total_rewards = [total + reward for total, reward in zip(total_rewards, rewards)]
+            if done:
+                break
+
+        info = dict(info, repeats=repeat + 1)
+        return self._push(observations), total_rewards, done, info
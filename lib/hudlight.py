@@ -31,7 +31,7 @@ import collections
 
 import pygame
 
-import pygametext
+from . import pygametext
 
 __version__ = '3.0.0'
 __vernum__ = tuple(int(s) for s in __version__.split('.'))
@@ -7,7 +7,9 @@
 
 from __future__ import division
 
+from collections import OrderedDict
 from math import ceil, sin, cos, radians, exp
+from weakref import WeakKeyDictionary
 import pygame
 
 DEFAULT_FONT_SIZE = 24
@@ -32,10 +34,57 @@ ANGLE_RESOLUTION_DEGREES = 3
 AUTO_CLEAN = True
 MEMORY_LIMIT_MB = 64
 MEMORY_REDUCTION_FACTOR = 0.5
+FONT_CACHE_SIZE = 64
+FIT_CACHE_SIZE = 4096
 
 pygame.font.init()
 
-_font_cache = {}
+
+# Least recently used first. A hit moves the entry to the end and eviction pops from the front, both
+# O(1). sizeof gives the cost of an entry against the limit passed to put() and shrink(); by default
+# every entry costs 1, which makes the limit a number of entries.
+class _LRUCache(object):
+    def __init__(self, sizeof=None):
+        self.items = OrderedDict()
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.items[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value, limit=None):
+        if key in self.items:
+            self.size -= self.sizeof(self.items.pop(key))
+        self.items[key] = value
+        self.size += self.sizeof(value)
+        if limit is not None:
+            self.shrink(limit)
+
+    def shrink(self, limit):
+        while self.size > limit and self.items:
+            key, value = self.items.popitem(last=False)
+            self.size -= self.sizeof(value)
+            self.evictions += 1
+
+    def stats(self):
+        return {"entries": len(self.items), "size": self.size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+_font_cache = _LRUCache()
 
 
 def getfont(fontname=None, fontsize=None, sysfontname=None,
@@ -47,8 +96,9 @@ def getfont(fontname=None, fontsize=None, sysfontname=None,
     if fontsize is None:
         fontsize = DEFAULT_FONT_SIZE
     key = fontname, fontsize, sysfontname, bold, italic, underline
-    if key in _font_cache:
-        return _font_cache[key]
+    font = _font_cache.get(key)
+    if font is not None:
+        return font
     if sysfontname is not None:
         font = pygame.font.SysFont(sysfontname, fontsize, bold or False, italic or False)
     else:
@@ -64,7 +114,7 @@ def getfont(fontname=None, fontsize=None, sysfontname=None,
         font.set_italic(italic)
     if underline is not None:
         font.set_underline(underline)
-    _font_cache[key] = font
+    _font_cache.put(key, font, FONT_CACHE_SIZE)
     return font
 
 
@@ -129,13 +179,14 @@ def wrap(text, fontname=None, fontsize=None, sysfontname=None,
     return lines
 
 
-_fit_cache = {}
+_fit_cache = _LRUCache()
 
 
 def _fitsize(text, fontname, sysfontname, bold, italic, underline, width, height, lineheight, pspace, strip):
     key = text, fontname, sysfontname, bold, italic, underline, width, height, lineheight, pspace, strip
-    if key in _fit_cache:
-        return _fit_cache[key]
+    fontsize = _fit_cache.get(key)
+    if fontsize is not None:
+        return fontsize
 
     def fits(fontsize):
         texts = wrap(text, fontname, fontsize, sysfontname, bold, italic, underline, width, strip)
@@ -159,7 +210,7 @@ def _fitsize(text, fontname, sysfontname, bold, italic, underline, width, height
             else:
                 b = c
         fontsize = a
-    _fit_cache[key] = fontsize
+    _fit_cache.put(key, fontsize, FIT_CACHE_SIZE)
     return fontsize
 
 
@@ -221,11 +272,10 @@ def _circlepoints(r):
     return points
 
 
-_surf_cache = {}
-_surf_tick_usage = {}
-_surf_size_total = 0
-_unrotated_size = {}
-_tick = 0
+# Sized in bytes of pixel data
+_surf_cache = _LRUCache(lambda surf: surf.get_pitch() * surf.get_height())
+# Size of each rotated surface before rotation, forgotten along with the surface once it is evicted
+_unrotated_size = WeakKeyDictionary()
 
 
 def getsurf(text, fontname=None, fontsize=None, sysfontname=None, bold=None, italic=None,
@@ -233,7 +283,6 @@ def getsurf(text, fontname=None, fontsize=None, sysfontname=None, bold=None, ita
             background=None, antialias=True, ocolor=None, owidth=None, scolor=None, shadow=None,
             gcolor=None, shade=None, alpha=1.0, align=None, lineheight=None, pspace=None, angle=0,
             cache=True):
-    global _tick, _surf_size_total
     if fontname is None:
         fontname = DEFAULT_FONT_NAME
     if fontsize is None:
@@ -265,10 +314,9 @@ def getsurf(text, fontname=None, fontsize=None, sysfontname=None, bold=None, ita
     key = (text, fontname, fontsize, sysfontname, bold, italic, underline, width, widthem, strip,
            color, background, antialias, ocolor, opx, scolor, spx, gcolor, alpha, align, lineheight,
            pspace, angle)
-    if key in _surf_cache:
-        _surf_tick_usage[key] = _tick
-        _tick += 1
-        return _surf_cache[key]
+    surf = _surf_cache.get(key)
+    if surf is not None:
+        return surf
     texts = wrap(text, fontname, fontsize, sysfontname, bold, italic, underline,
                  width=width, widthem=widthem, strip=strip)
     if angle:
@@ -280,7 +328,7 @@ def getsurf(text, fontname=None, fontsize=None, sysfontname=None, bold=None, ita
             surf = pygame.transform.rotate(surf0, angle)
         else:
             surf = pygame.transform.rotozoom(surf0, angle, 1.0)
-        _unrotated_size[(surf.get_size(), angle, text)] = surf0.get_size()
+        _unrotated_size[surf] = surf0.get_size()
     elif alpha < 1.0:
         surf0 = getsurf(text, fontname, fontsize, sysfontname, bold, italic, underline,
                         width, widthem, strip, color, background, antialias,
@@ -399,11 +447,9 @@ def getsurf(text, fontname=None, fontsize=None, sysfontname=None, bold=None, ita
                 x = int(round(align * (w - lsurf.get_width())))
                 surf.blit(lsurf, (x, y))
     if cache:
-        w, h = surf.get_size()
-        _surf_size_total += 4 * w * h
-        _surf_cache[key] = surf
-        _surf_tick_usage[key] = _tick
-        _tick += 1
+        # With AUTO_CLEAN, the least recently used surfaces make room for this one as soon as the cache
+        # is over its memory limit
+        _surf_cache.put(key, surf, MEMORY_LIMIT_MB * (1 << 20) if AUTO_CLEAN else None)
     return surf
 
 
@@ -478,7 +524,7 @@ def draw(text, pos=None,
                     align, lineheight, pspace, angle, cache)
     angle = _resolveangle(angle)
     if angle:
-        w0, h0 = _unrotated_size[(tsurf.get_size(), angle, text)]
+        w0, h0 = _unrotated_size[tsurf]
         S, C = sin(radians(angle)), cos(radians(angle))
         dx, dy = (0.5 - hanchor) * w0, (0.5 - vanchor) * h0
         x += dx * C + dy * S - 0.5 * tsurf.get_width()
@@ -519,16 +565,12 @@ def drawbox(text, rect, fontname=None, sysfontname=None, lineheight=None, pspace
 
 
 def clean():
-    global _surf_size_total
     memory_limit = MEMORY_LIMIT_MB * (1 << 20)
-    if _surf_size_total < memory_limit:
+    if _surf_cache.size < memory_limit:
         return
-    memory_limit *= MEMORY_REDUCTION_FACTOR
-    keys = sorted(_surf_cache, key=_surf_tick_usage.get)
-    for key in keys:
-        w, h = _surf_cache[key].get_size()
-        del _surf_cache[key]
-        del _surf_tick_usage[key]
-        _surf_size_total -= 4 * w * h
-        if _surf_size_total < memory_limit:
-            break
+    _surf_cache.shrink(memory_limit * MEMORY_REDUCTION_FACTOR)
+
+
+# Hits, misses, evictions, entries and size (bytes for the surfaces, entries otherwise) of each cache
+def cache_stats():
+    return {"surf": _surf_cache.stats(), "font": _font_cache.stats(), "fit": _fit_cache.stats()}
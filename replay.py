@@ -0,0 +1,214 @@
+import struct
+import zlib
+from collections import namedtuple
+
+# A replay file is a short uncompressed header followed by a zlib stream of records:
+#
+#   ROUND   round seed, the starting score and tank placement of every agent
+#   TICKS   a run of consecutive ticks in which every agent took the same actions: the run length and one
+#           action bit mask per agent (see Agent.act_mask)
+#   SCORES  the score of every agent at the end of the round, used to check the playback
+#
+# Records are appended while the game runs and the stream is flushed at the end of every round, so a
+# crash loses at most the round in progress.
+MAGIC = b'RLTR'
+VERSION = 1
+
+ROUND = b'R'
+TICKS = b'T'
+SCORES = b'S'
+
+HEADER = struct.Struct('<4sBqHHB')       # magic, version, game seed, canvas length and width, agents
+ROUND_SEED = struct.Struct('<q')
+PLACEMENT = struct.Struct('<ihhH')       # starting score, x, y, direction
+RUN_LENGTH = struct.Struct('<H')
+SCORE = struct.Struct('<i')
+
+MAX_RUN_LENGTH = 0xffff
+
+Round = namedtuple('Round', ['seed', 'scores', 'placements', 'runs', 'final_scores'])
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayRecorder:
+    # Records every round of a game into a replay file, starting with the next reset(), e.g.
+    #
+    #     with ReplayRecorder(game, 'round.replay'):
+    #         game.run()
+    def __init__(self, game_obj, path):
+        self.game = game_obj
+        self.file = open(path, 'wb')
+        self.compressor = zlib.compressobj()
+
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.game.seed, self.game.canvas_length,
+                                    self.game.canvas_width, len(self.game.player_agents)))
+
+        # Ticks with the same actions as the previous one only extend the current run
+        self.run_masks = None
+        self.run_length = 0
+        self.in_round = False
+
+        self.game.recorder = self
+
+    def _write(self, data):
+        self.file.write(self.compressor.compress(data))
+
+    def _flush_run(self):
+        if self.run_length:
+            self._write(TICKS + RUN_LENGTH.pack(self.run_length) + bytes(bytearray(self.run_masks)))
+        self.run_masks = None
+        self.run_length = 0
+
+    def _end_round(self):
+        if not self.in_round:
+            return
+        self._flush_run()
+        self._write(SCORES + b''.join(SCORE.pack(agent.score) for agent in self.game.player_agents))
+        self.file.write(self.compressor.flush(zlib.Z_FULL_FLUSH))
+        self.file.flush()
+        self.in_round = False
+
+    def begin_round(self):
+        # Called by Game.reset() once the tanks of the new round are in place
+        self._end_round()
+
+        record = ROUND + ROUND_SEED.pack(self.game.round_seed)
+        for agent in self.game.player_agents:
+            tank = agent.sprite
+            record += PLACEMENT.pack(agent.score, tank.rect.x, tank.rect.y, tank.direction)
+        self._write(record)
+        self.in_round = True
+
+    def record_tick(self, masks):
+        # Called by Game.end_tick() with the action mask of every agent
+        if not self.in_round:
+            return
+        if masks == self.run_masks and self.run_length < MAX_RUN_LENGTH:
+            self.run_length += 1
+        else:
+            self._flush_run()
+            self.run_masks = masks
+            self.run_length = 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        self._end_round()
+        self.file.write(self.compressor.flush())
+        self.file.close()
+        if self.game.recorder is self:
+            self.game.recorder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class ReplayPlayer:
+    # Reads a replay file and plays its rounds back on a new Game, headless at full speed or rendered
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            data = f.read()
+
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ReplayError('%s is not a replay file' % path)
+        magic, version, self.seed, self.canvas_length, self.canvas_width, self.num_agents = HEADER.unpack(header)
+        if version != VERSION:
+            raise ReplayError('Unsupported replay version %d' % version)
+
+        # A file whose recording was interrupted still decompresses up to its last complete round
+        decompressor = zlib.decompressobj()
+        try:
+            data = decompressor.decompress(data)
+        except zlib.error as e:
+            raise ReplayError('Corrupt replay data: %s' % e)
+        self.rounds = self._parse(data, complete=decompressor.eof)
+
+    def _parse(self, data, complete=True):
+        rounds = []
+        offset = 0
+        current = None
+        while offset < len(data):
+            record_offset = offset
+            tag = data[offset:offset + 1]
+            offset += 1
+            if tag in (TICKS, SCORES) and current is None:
+                raise ReplayError('Replay record %r at offset %d is outside a round' % (tag, record_offset))
+            try:
+                if tag == ROUND:
+                    (seed,) = ROUND_SEED.unpack_from(data, offset)
+                    offset += ROUND_SEED.size
+                    scores, placements = [], []
+                    for _ in range(self.num_agents):
+                        score, x, y, direction = PLACEMENT.unpack_from(data, offset)
+                        offset += PLACEMENT.size
+                        scores.append(score)
+                        placements.append((x, y, direction))
+                    current = Round(seed, scores, placements, [], None)
+                elif tag == TICKS:
+                    (length,) = RUN_LENGTH.unpack_from(data, offset)
+                    offset += RUN_LENGTH.size
+                    masks = list(bytearray(data[offset:offset + self.num_agents]))
+                    if len(masks) < self.num_agents:
+                        raise struct.error('run of %d masks cut off' % self.num_agents)
+                    offset += self.num_agents
+                    current.runs.append((length, masks))
+                elif tag == SCORES:
+                    final_scores = [SCORE.unpack_from(data, offset + i * SCORE.size)[0]
+                                    for i in range(self.num_agents)]
+                    offset += self.num_agents * SCORE.size
+                    rounds.append(current._replace(final_scores=final_scores))
+                    current = None
+                else:
+                    raise ReplayError('Corrupt replay record %r at offset %d' % (tag, record_offset))
+            except struct.error:
+                # The unfinished last round of an interrupted recording may be cut off anywhere; a file whose
+                # recording was closed properly must not be
+                if complete:
+                    raise ReplayError('Truncated replay record %r at offset %d' % (tag, record_offset))
+                break
+        return rounds
+
+    def create_game(self, headless=True, **game_kwargs):
+        from game_sim import Game
+        return Game(self.canvas_length, self.canvas_width, headless=headless, seed=self.seed, **game_kwargs)
+
+    def play(self, headless=True, tick_rate=None, render_every=1):
+        # Play every round back and return the game, raising ReplayError if any round diverges
+        game = self.create_game(headless=headless)
+        for replay_round in self.rounds:
+            self.play_round(game, replay_round, tick_rate=tick_rate, render_every=render_every)
+        return game
+
+    def play_round(self, game, replay_round, tick_rate=None, render_every=1):
+        for agent, score in zip(game.player_agents, replay_round.scores):
+            agent.score = score
+        game.reset(placements=replay_round.placements, round_seed=replay_round.seed)
+
+        rendering = not game.headless and render_every
+        if rendering:
+            game.full_redraw = True
+            game.render()
+
+        ticks = 0
+        for length, masks in replay_round.runs:
+            for _ in range(length):
+                for agent, mask in zip(game.player_agents, masks):
+                    agent.act_mask(mask)
+                game.end_tick()
+
+                ticks += 1
+                if rendering and ticks % render_every == 0:
+                    game.render()
+                    # tick_rate counts logic ticks per second, and a frame shows render_every of them
+                    game.clock.tick(tick_rate / render_every if tick_rate else 0)
+
+        final_scores = [agent.score for agent in game.player_agents]
+        if final_scores != replay_round.final_scores:
+            raise ReplayError('Replay diverged: scores %r instead of %r' % (final_scores, replay_round.final_scores))
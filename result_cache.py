@@ -0,0 +1,115 @@
+import hashlib
+import inspect
+import json
+import sqlite3
+
+import numpy as np
+
+# Bump when the rules change in a way the constants below don't capture, to invalidate every cached result
+RULES_VERSION = 1
+
+
+def params_hash(params):
+    # Content hash of a dict of parameter arrays: names, dtypes, shapes and bytes
+    digest = hashlib.sha256()
+    for name in sorted(params):
+        array = np.ascontiguousarray(params[name])
+        digest.update(('%s|%s|%r|' % (name, array.dtype.str, array.shape)).encode('utf-8'))
+        digest.update(array.view(np.uint8).ravel())
+    return digest.hexdigest()
+
+
+def rules_fingerprint(game_kwargs=None):
+    # Everything besides the agents and the seed that decides the outcome of a match: the Game arguments
+    # (with their defaults filled in), the rules constants of game_objects and the state discretization
+    # of the agents
+    import game_agents
+    import game_objects
+    from game_sim import Game
+
+    config = dict((name, parameter.default) for name, parameter in inspect.signature(Game.__init__).parameters.items()
+                  if parameter.default is not inspect.Parameter.empty)
+    config.update(game_kwargs or {})
+    # Neither changes what happens in a headless game
+    for name in ('headless', 'dirty_rects', 'tick_rate', 'render_every', 'profile', 'profile_hud', 'seed'):
+        config.pop(name, None)
+    config['observer'] = getattr(config.get('observer'), '__name__', repr(config.get('observer')))
+
+    rules = dict((name, getattr(game_objects, name)) for name in
+                 ('TANK_SIZE', 'TANK_SPEED', 'PROJECTILE_SIZE', 'PROJECTILE_SPEED', 'MUZZLE_OFFSET', 'HIT_REWARD',
+                  'FRIENDLY_FIRE_PENALTY'))
+    rules['FORWARD_UNIT'] = sorted(game_objects.FORWARD_UNIT.items())
+    rules['OFFSET_EDGES'] = game_agents.OFFSET_EDGES
+    rules['OFFSET_RESOLUTION'] = game_agents.OFFSET_RESOLUTION
+
+    return json.dumps({'version': RULES_VERSION, 'config': config, 'rules': rules}, sort_keys=True)
+
+
+def match_key(params_hash_a, params_hash_b, seed, rules, **evaluation):
+    # Key of one match: both agents' parameter hashes (in side order), the seed, the rules fingerprint and
+    # how the match is played (e.g. rounds and epsilon)
+    text = json.dumps([params_hash_a, params_hash_b, seed, rules, sorted(evaluation.items())])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    # Persistent match results in an SQLite file, keyed by match_key(), holding at most max_entries results.
+    # When it is full, the least recently used results are evicted. Hits only note their use in memory;
+    # the notes are written with the next put() or close(), so a run of lookups costs no writes.
+    def __init__(self, path, max_entries=1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, score_a INTEGER, '
+                                'score_b INTEGER, last_used INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.connection.commit()
+
+        # Uses are numbered rather than timed, so the order is exact even within a clock tick
+        self.clock, self.count = self.connection.execute('SELECT MAX(last_used), COUNT(*) FROM results').fetchone()
+        self.clock = self.clock or 0
+        # Keys hit since the last write, with the number of their last use
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.count
+
+    def get(self, key):
+        # (score_a, score_b) of a cached match, or None
+        row = self.connection.execute('SELECT score_a, score_b FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.clock += 1
+        self.used[key] = self.clock
+        return row
+
+    def _write_used(self):
+        if self.used:
+            self.connection.executemany('UPDATE results SET last_used = ? WHERE key = ?',
+                                        [(clock, key) for key, clock in self.used.items()])
+            self.used = {}
+
+    def put(self, key, score_a, score_b):
+        # The uses noted since the last write go in first, so that eviction sees them
+        self._write_used()
+        self.clock += 1
+        row = (int(score_a), int(score_b), self.clock, key)
+        if self.connection.execute('UPDATE results SET score_a = ?, score_b = ?, last_used = ? WHERE key = ?',
+                                   row).rowcount == 0:
+            self.connection.execute('INSERT INTO results (score_a, score_b, last_used, key) VALUES (?, ?, ?, ?)',
+                                    row)
+            self.count += 1
+        if self.count > self.max_entries:
+            self.count -= self.connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                                                  'ORDER BY last_used LIMIT ?)',
+                                                  (self.count - self.max_entries,)).rowcount
+        self.connection.commit()
+
+    def close(self):
+        self._write_used()
+        self.connection.commit()
+        self.connection.close()
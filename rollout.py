@@ -0,0 +1,183 @@
+import multiprocessing
+import queue
+import random
+import traceback
+from collections import namedtuple
+
+import numpy as np
+
+from game_agents import ACTIONS
+
+# One round of self-play as seen by one of the agents
+Trajectory = namedtuple('Trajectory', ['worker', 'episode', 'agent', 'observations', 'actions', 'rewards',
+                                       'truncated'])
+
+# Games are always headless in the workers; rounds that nobody wins are cut off after this many steps
+DEFAULT_GAME_KWARGS = {'max_round_steps': 2000}
+
+# Seconds between checks that the workers are still alive while waiting for trajectories
+POLL_INTERVAL = 1.0
+
+
+def random_policy(observation):
+    return random.choice(ACTIONS)
+
+
+def _keep(observation):
+    # Observers may hand out views of buffers they reuse (e.g. PixelObserver's frames), so arrays that go
+    # into a trajectory are copied; tuples of plain numbers are immutable and kept as they are
+    if isinstance(observation, np.ndarray):
+        return np.array(observation)
+    if isinstance(observation, tuple) and observation and isinstance(observation[0], np.ndarray):
+        return tuple(np.array(part) for part in observation)
+    return observation
+
+
+class _WorkerFinished:
+    def __init__(self, worker):
+        self.worker = worker
+
+
+class _WorkerFailed:
+    def __init__(self, worker, message):
+        self.worker = worker
+        self.message = message
+
+
+def _rollout_worker(worker, policy, episodes, game_kwargs, seed, results, policy_updates):
+    try:
+        # Import here so that the learner process never has to initialize pygame itself
+        from game_sim import Game
+
+        random.seed(seed + worker)
+        game = Game(headless=True, **game_kwargs)
+        num_agents = len(game.player_agents)
+
+        for episode in range(episodes):
+            # Pick up the newest policy the learner has published, without waiting for one
+            while not policy_updates.empty():
+                try:
+                    policy = policy_updates.get_nowait()
+                except Exception:
+                    break
+
+            observations = [[] for _ in range(num_agents)]
+            actions = [[] for _ in range(num_agents)]
+            rewards = [[] for _ in range(num_agents)]
+
+            step_observations = game.reset()
+            done = False
+            info = {'truncated': False}
+            while not done:
+                step_actions = [policy(observation) for observation in step_observations]
+                for i in range(num_agents):
+                    observations[i].append(_keep(step_observations[i]))
+                    actions[i].append(step_actions[i])
+
+                step_observations, step_rewards, done, info = game.step(step_actions)
+                for i in range(num_agents):
+                    rewards[i].append(step_rewards[i])
+
+            # One message per agent per round keeps the IPC cost independent of the round length.
+            # put() blocks while the queue is full, which throttles workers that are ahead of the learner.
+            for i in range(num_agents):
+                results.put(Trajectory(worker, episode, i, observations[i], actions[i], rewards[i],
+                                       info['truncated']))
+
+        results.put(_WorkerFinished(worker))
+    except Exception:
+        results.put(_WorkerFailed(worker, traceback.format_exc()))
+
+
+class RolloutRunner:
+    # Plays headless self-play rounds on a pool of worker processes and streams the trajectories back
+    # to the learner, e.g.
+    #
+    #     with RolloutRunner(policy, num_workers=8, episodes_per_worker=1000) as runner:
+    #         for trajectory in runner.trajectories():
+    #             learner.learn(trajectory)
+    #             runner.update_policy(learner.policy)
+    #
+    # The policy is a picklable callable mapping one agent's observation to one of game_agents.ACTIONS,
+    # and both agents of every game use it. At most max_pending trajectories wait for the learner at a
+    # time; beyond that the workers block until the learner catches up.
+    def __init__(self, policy=random_policy, num_workers=None, episodes_per_worker=1, max_pending=256,
+                 game_kwargs=None, seed=0):
+        self.policy = policy
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.episodes_per_worker = episodes_per_worker
+        self.max_pending = max_pending
+        self.game_kwargs = DEFAULT_GAME_KWARGS if game_kwargs is None else game_kwargs
+        self.seed = seed
+
+        self.workers = []
+        self.results = None
+        self.policy_updates = []
+
+    def start(self):
+        self.results = multiprocessing.Queue(maxsize=self.max_pending)
+        for worker in range(self.num_workers):
+            policy_updates = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_rollout_worker,
+                                              args=(worker, self.policy, self.episodes_per_worker,
+                                                    self.game_kwargs, self.seed, self.results, policy_updates))
+            process.daemon = True
+            process.start()
+            self.workers.append(process)
+            self.policy_updates.append(policy_updates)
+
+    def update_policy(self, policy):
+        # Workers switch to the new policy at the start of their next round
+        self.policy = policy
+        for policy_updates in self.policy_updates:
+            policy_updates.put(policy)
+
+    def trajectories(self):
+        if not self.workers:
+            self.start()
+
+        running = len(self.workers)
+        while running:
+            try:
+                message = self.results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if isinstance(message, _WorkerFinished):
+                running -= 1
+            elif isinstance(message, _WorkerFailed):
+                self.close()
+                raise RuntimeError('Rollout worker %d failed:\n%s' % (message.worker, message.message))
+            else:
+                yield message
+
+        self.close()
+
+    def _check_workers(self):
+        # Workers that return normally, even after a failure, exit with code 0 once their last message is
+        # in the queue. Any other exit code means the worker was killed, e.g. by a signal or the OOM killer.
+        for worker, process in enumerate(self.workers):
+            if not process.is_alive() and process.exitcode != 0:
+                exitcode = process.exitcode
+                self.close()
+                raise RuntimeError('Rollout worker %d died with exit code %s' % (worker, exitcode))
+
+    def close(self):
+        for process in self.workers:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        # Policies the workers never picked up would otherwise keep the queues' feeder threads blocked on a
+        # full pipe, and the interpreter waits for them at exit
+        for policy_updates in self.policy_updates:
+            policy_updates.cancel_join_thread()
+            policy_updates.close()
+        self.workers = []
+        self.policy_updates = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -0,0 +1,271 @@
+import multiprocessing
+import queue
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Same defaults as rollout.py, which isn't imported so that the learner process never loads pygame
+DEFAULT_GAME_KWARGS = {'max_round_steps': 2000}
+
+# Cache line size. Every field starts on a line of its own, and in padded fields so does every worker's
+# row, so that workers writing their own rows never write to the same line.
+ALIGNMENT = 64
+
+# Seconds between checks that the workers are still alive while waiting for them
+POLL_INTERVAL = 1.0
+
+
+def _aligned(nbytes):
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class SharedSlots:
+    # NumPy arrays laid out in one block of shared memory. The creating process passes name=None and
+    # unlinks the block when done; other processes attach to it by name with the same layout, a list of
+    # (field, shape, dtype, padded). The rows (first index) of a padded field are each rounded up to
+    # whole cache lines, which makes the array non-contiguous; unpadded fields are plain C arrays.
+    def __init__(self, layout, name=None):
+        fields = []
+        size = 0
+        for field, shape, dtype, padded in layout:
+            dtype = np.dtype(dtype)
+            strides = [dtype.itemsize]
+            for length in reversed(shape[1:]):
+                strides.insert(0, strides[0] * length)
+            if padded:
+                strides[0] = _aligned(strides[0])
+            fields.append((field, shape, dtype, size, tuple(strides)))
+            size += _aligned(shape[0] * strides[0])
+
+        self.layout = layout
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, 1))
+        self.name = self.memory.name
+        self.arrays = dict((field, np.ndarray(shape, dtype, self.memory.buf, offset, strides))
+                           for field, shape, dtype, offset, strides in fields)
+
+    def __getitem__(self, field):
+        return self.arrays[field]
+
+    def close(self):
+        # The arrays hold pointers into the block, which can't be closed while they exist
+        self.arrays = {}
+        try:
+            self.memory.close()
+        except BufferError:
+            # Views handed out earlier are still alive; the mapping goes away with the last of them
+            pass
+        if self.owner:
+            self.memory.unlink()
+
+
+def _observation_parts(observations):
+    # The observations of all agents as arrays with a row per agent: one array, or one per part for
+    # observers whose observations are tuples of arrays (e.g. OccupancyObserver)
+    if isinstance(observations, np.ndarray):
+        return [observations]
+    if isinstance(observations[0], tuple) and isinstance(observations[0][0], np.ndarray):
+        return [np.stack(part) for part in zip(*observations)]
+    return [np.asarray(observations)]
+
+
+def _observation_fields(observation_specs):
+    return ['observations%d' % part for part in range(len(observation_specs))]
+
+
+def _layout(num_workers, num_agents, observation_specs):
+    # One field per part of the observations, each with the (shape, dtype) of observation_specs. They stay
+    # contiguous so that the learner can batch them without a copy; their rows are large, so workers share
+    # at most the line at either end of theirs.
+    layout = [(field, (num_workers, num_agents) + tuple(shape), dtype, False)
+              for field, (shape, dtype) in zip(_observation_fields(observation_specs), observation_specs)]
+    return layout + [('actions', (num_workers, num_agents), 'uint8', True),
+                     ('rewards', (num_workers, num_agents), 'int32', True),
+                     ('dones', (num_workers,), 'bool', True),
+                     ('truncated', (num_workers,), 'bool', True),
+                     ('running', (1,), 'bool', False)]
+
+
+def _put_observations(rows, observations):
+    for row, part in zip(rows, _observation_parts(observations)):
+        row[...] = part
+
+
+def _step_loop(worker, game, slots, observation_rows, ready, go):
+    running = slots['running']
+    actions = slots['actions'][worker]
+    while True:
+        go.acquire()
+        if not running[0]:
+            return
+        observations, rewards, done, info = game.step(actions)
+        slots['rewards'][worker] = rewards
+        slots['dones'][worker] = done
+        slots['truncated'][worker] = info['truncated']
+        # Rounds restart right away; the observations are then the first ones of the next round
+        _put_observations(observation_rows, game.reset() if done else observations)
+        ready.release()
+
+
+def _shared_worker(worker, game_kwargs, observer, seed, messages, layouts, ready, go):
+    slots = None
+    try:
+        # Import here so that the learner process never has to initialize pygame itself
+        from game_observations import OBSERVERS
+        from game_sim import Game
+
+        game = Game(headless=True, observer=OBSERVERS[observer], seed=seed + worker, **game_kwargs)
+        observations = game.reset()
+        # The learner sizes the shared block from the observations of the first round
+        specs = tuple((part.shape[1:], part.dtype.str) for part in _observation_parts(observations))
+        messages.put((worker, (specs, len(game.player_agents))))
+
+        slots = SharedSlots(*layouts.get())
+        observation_rows = [slots[field][worker] for field in _observation_fields(specs)]
+        _put_observations(observation_rows, observations)
+        ready.release()
+        _step_loop(worker, game, slots, observation_rows, ready, go)
+    except Exception:
+        messages.put((worker, traceback.format_exc()))
+    finally:
+        if slots is not None:
+            slots.close()
+
+
+class SharedRolloutRunner:
+    # Steps one headless game per worker process in lock-step with the learner, which picks the actions
+    # of every agent of every game in one batch, e.g.
+    #
+    #     with SharedRolloutRunner(num_workers=8, observer='features') as runner:
+    #         observations = runner.observations
+    #         while learning:
+    #             batch = observations.reshape((-1,) + observations.shape[2:])
+    #             actions = policy(batch).reshape(runner.num_workers, -1)
+    #             observations, rewards, dones, truncated = runner.step(actions)
+    #
+    # Observations, actions, rewards and done flags live in one block of shared memory with a slot per
+    # worker. The workers write their step results into their slots and the arrays step() returns are
+    # views of the whole block: nothing is pickled or copied on the way to the learner, so keep copies
+    # of whatever has to outlive the next step(). Each worker waits on a semaphore for its actions and
+    # signals another when its results are in place.
+    #
+    # Observers are named as in game_observations.OBSERVERS. The observations are a workers x agents x
+    # observation shape array, or a tuple of such arrays, one per part, for observers whose observations
+    # are tuples of arrays (e.g. 'occupancy').
+    def __init__(self, num_workers=None, game_kwargs=None, observer=None, seed=0):
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.game_kwargs = DEFAULT_GAME_KWARGS if game_kwargs is None else game_kwargs
+        self.observer = observer
+        self.seed = seed
+
+        self.workers = []
+        self.ready = []
+        self.go = []
+        self.messages = None
+        self.slots = None
+        self.observation_fields = None
+
+    def start(self):
+        # The workers must share the learner's resource tracker: one of their own would unlink the shared
+        # block as soon as its worker exits
+        resource_tracker.ensure_running()
+        self.messages = multiprocessing.Queue()
+        layouts = multiprocessing.Queue()
+        for worker in range(self.num_workers):
+            ready, go = multiprocessing.Semaphore(0), multiprocessing.Semaphore(0)
+            process = multiprocessing.Process(target=_shared_worker,
+                                              args=(worker, self.game_kwargs, self.observer, self.seed,
+                                                    self.messages, layouts, ready, go))
+            process.daemon = True
+            process.start()
+            self.workers.append(process)
+            self.ready.append(ready)
+            self.go.append(go)
+
+        specs = set(self._message() for _ in range(self.num_workers))
+        if len(specs) > 1:
+            self.close()
+            raise RuntimeError('Shared rollout workers disagree on the observations: %s' % sorted(specs))
+        observation_specs, num_agents = specs.pop()
+        layout = _layout(self.num_workers, num_agents, observation_specs)
+        self.observation_fields = _observation_fields(observation_specs)
+        self.slots = SharedSlots(layout)
+        self.slots['running'][0] = True
+        for _ in range(self.num_workers):
+            layouts.put((layout, self.slots.name))
+        self._wait()
+
+    def _message(self):
+        # Observation spec of the next worker to start up
+        while True:
+            try:
+                worker, message = self.messages.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if isinstance(message, str):
+                self.close()
+                raise RuntimeError('Shared rollout worker %d failed:\n%s' % (worker, message))
+            return message
+
+    def _check_workers(self):
+        dead = [worker for worker, process in enumerate(self.workers) if not process.is_alive()]
+        if not dead:
+            return
+        # A worker that raised has left its traceback behind
+        worker, message = dead[0], 'exited with code %s' % self.workers[dead[0]].exitcode
+        while True:
+            try:
+                failed, failure = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(failure, str):
+                worker, message = failed, failure
+                break
+        self.close()
+        raise RuntimeError('Shared rollout worker %d failed:\n%s' % (worker, message))
+
+    def _wait(self):
+        for ready in self.ready:
+            while not ready.acquire(timeout=POLL_INTERVAL):
+                self._check_workers()
+
+    @property
+    def observations(self):
+        parts = [self.slots[field] for field in self.observation_fields]
+        return parts[0] if len(parts) == 1 else tuple(parts)
+
+    def step(self, actions):
+        # actions has one row of actions per worker, one per agent. Returns the observations, rewards,
+        # dones and truncated flags of every worker as views of the shared block.
+        self.slots['actions'][...] = actions
+        for go in self.go:
+            go.release()
+        self._wait()
+        slots = self.slots
+        return self.observations, slots['rewards'], slots['dones'], slots['truncated']
+
+    def close(self):
+        if self.slots is not None:
+            self.slots['running'][0] = False
+        for go in self.go:
+            go.release()
+        for process in self.workers:
+            process.join(POLL_INTERVAL)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.workers = []
+        self.ready = []
+        self.go = []
+        if self.slots is not None:
+            self.slots.close()
+            self.slots = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -0,0 +1,82 @@
+class SpatialGrid:
+    # Uniform grid of square cells over the arena, used to find the objects close to a point or rect
+    # without testing against every object in the game.
+    #
+    # Every item is registered in each cell that its rect overlaps, with the rect grown by `margin` pixels
+    # to the left and top. That way query_point(x, y) finds every item overlapping the margin x margin box
+    # whose top-left corner is (x, y), e.g. a projectile, with a single cell lookup. Items are moved
+    # incrementally: only the cells they enter and leave are touched.
+    def __init__(self, length, width, cell_size=64, margin=0):
+        self.cell_size = cell_size
+        self.margin = margin
+        self.columns = max(1, (length + cell_size - 1) // cell_size)
+        self.rows = max(1, (width + cell_size - 1) // cell_size)
+
+        self.cells = [set() for _ in range(self.columns * self.rows)]
+        self.item_cells = {}
+
+    def __len__(self):
+        return len(self.item_cells)
+
+    def __contains__(self, item):
+        return item in self.item_cells
+
+    def _column(self, x):
+        return min(max(x // self.cell_size, 0), self.columns - 1)
+
+    def _row(self, y):
+        return min(max(y // self.cell_size, 0), self.rows - 1)
+
+    def _cells(self, left, top, right, bottom):
+        # Indices of the cells overlapping the pixels left..right-1 x top..bottom-1
+        columns = range(self._column(left), self._column(right - 1) + 1)
+        return tuple(row * self.columns + column
+                     for row in range(self._row(top), self._row(bottom - 1) + 1)
+                     for column in columns)
+
+    def _item_cells(self, rect):
+        return self._cells(rect.left - self.margin + 1, rect.top - self.margin + 1, rect.right, rect.bottom)
+
+    def insert(self, item, rect):
+        if item in self.item_cells:
+            self.move(item, rect)
+            return
+
+        cells = self._item_cells(rect)
+        for cell in cells:
+            self.cells[cell].add(item)
+        self.item_cells[item] = cells
+
+    def move(self, item, rect):
+        old_cells = self.item_cells[item]
+        new_cells = self._item_cells(rect)
+        if new_cells == old_cells:
+            return
+
+        for cell in old_cells:
+            if cell not in new_cells:
+                self.cells[cell].discard(item)
+        for cell in new_cells:
+            self.cells[cell].add(item)
+        self.item_cells[item] = new_cells
+
+    def remove(self, item):
+        for cell in self.item_cells.pop(item, ()):
+            self.cells[cell].discard(item)
+
+    def clear(self):
+        for cells in self.cells:
+            cells.clear()
+        self.item_cells.clear()
+
+    def query_point(self, x, y):
+        # Items that may overlap the margin x margin box at (x, y); the caller does the exact test.
+        # The returned set belongs to the grid and must not be modified.
+        return self.cells[self._row(y) * self.columns + self._column(x)]
+
+    def query(self, rect):
+        # Items that may overlap rect; the caller does the exact test
+        found = set()
+        for cell in self._cells(rect.left, rect.top, rect.right, rect.bottom):
+            found.update(self.cells[cell])
+        return found
@@ -0,0 +1,201 @@
+import itertools
+import multiprocessing
+from collections import namedtuple
+
+# One match between two saved generations, from the point of view of generation_a: outcome is 1 for a win,
+# 0.5 for a draw and 0 for a loss
+MatchResult = namedtuple('MatchResult', ['generation_a', 'generation_b', 'seed', 'score_a', 'score_b', 'outcome'])
+
+DEFAULT_GAME_KWARGS = {'max_round_steps': 2000}
+
+# Per-process caches of the worker processes: opened checkpoint stores and loaded parameters
+_stores = {}
+_params = {}
+
+
+def _load_params(store_path, generation):
+    from checkpoints import CheckpointStore
+
+    key = store_path, generation
+    if key not in _params:
+        if store_path not in _stores:
+            _stores[store_path] = CheckpointStore(store_path)
+        _params[key] = _stores[store_path].load(generation)
+    return _params[key]
+
+
+def play_match(store_path, generation_a, generation_b, seed, rounds, epsilon, game_kwargs):
+    # Play `rounds` rounds between two generations of QLearningAgent in a headless game. The seed picks the
+    # game's round seeds and the agents' exploration, and its parity which side generation_a plays.
+    from game_agents import QLearningAgent
+    from game_observations import FeatureObserver
+    from game_sim import Game
+
+    game = Game(headless=True, observer=FeatureObserver, seed=seed, **game_kwargs)
+    sides = (generation_a, generation_b) if seed % 2 == 0 else (generation_b, generation_a)
+    for i, generation in enumerate(sides):
+        agent = QLearningAgent('Generation %d' % generation, game, learning_rate=0.0, epsilon=epsilon,
+                               seed=seed * 2 + i)
+        agent.set_params(_load_params(store_path, generation))
+        game.player_agents[i] = agent
+
+    for _ in range(rounds):
+        game.reset()
+        while game.round_not_over:
+            game.tick()
+
+    scores = [agent.score for agent in game.player_agents]
+    score_a, score_b = scores if seed % 2 == 0 else scores[::-1]
+    return match_result(generation_a, generation_b, seed, score_a, score_b)
+
+
+def match_result(generation_a, generation_b, seed, score_a, score_b):
+    outcome = 1.0 if score_a > score_b else 0.0 if score_a < score_b else 0.5
+    return MatchResult(generation_a, generation_b, seed, score_a, score_b, outcome)
+
+
+def _play_match(task):
+    return play_match(*task)
+
+
+def expected_score(rating_a, rating_b):
+    return 1.0 / (1.0 + 10 ** ((rating_b - rating_a) / 400.0))
+
+
+class Tournament:
+    # Plays the saved generations of a checkpoints.CheckpointStore against each other on a pool of
+    # headless games and rates them with Elo, e.g.
+    #
+    #     with Tournament('checkpoints', seeds=range(8)) as tournament:
+    #         for result in tournament.round_robin():
+    #             print(result, tournament.standings()[:3])
+    #
+    # Results stream back in the order the matches finish and every one updates the ratings right away,
+    # so the standings are usable long before the whole schedule has been played.
+    #
+    # With a result_cache.ResultCache, matches whose agents, seed, rules and settings were played before
+    # (by this or any earlier tournament sharing the cache file) are looked up instead of simulated.
+    def __init__(self, store_path, generations=None, num_workers=None, seeds=(0, 1), rounds=5, epsilon=0.05,
+                 game_kwargs=None, k_factor=16.0, initial_rating=1000.0, cache=None):
+        from checkpoints import CheckpointStore
+
+        self.store_path = store_path
+        self.store = CheckpointStore(store_path)
+        if generations is None:
+            generations = [entry['generation'] for entry in self.store.generations()]
+        self.generations = list(generations)
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.seeds = list(seeds)
+        self.rounds = rounds
+        self.epsilon = epsilon
+        self.game_kwargs = DEFAULT_GAME_KWARGS if game_kwargs is None else game_kwargs
+        self.k_factor = k_factor
+
+        self.ratings = dict((generation, initial_rating) for generation in self.generations)
+        self.played = dict((generation, 0) for generation in self.generations)
+        self.points = dict((generation, 0.0) for generation in self.generations)
+        self.results = []
+        self.pool = None
+
+        self.cache = cache
+        self.rules = None
+        self.params_hashes = {}
+        self.simulated = 0
+
+    def start(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.num_workers)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def record(self, result):
+        # Incremental Elo update for one match
+        a, b = result.generation_a, result.generation_b
+        expected = expected_score(self.ratings[a], self.ratings[b])
+        change = self.k_factor * (result.outcome - expected)
+        self.ratings[a] += change
+        self.ratings[b] -= change
+        self.played[a] += 1
+        self.played[b] += 1
+        self.points[a] += result.outcome
+        self.points[b] += 1.0 - result.outcome
+        self.results.append(result)
+
+    def standings(self):
+        # (generation, rating, matches played, points), best first
+        return sorted(((generation, self.ratings[generation], self.played[generation], self.points[generation])
+                       for generation in self.generations), key=lambda standing: -standing[1])
+
+    def match_key(self, generation_a, generation_b, seed):
+        from result_cache import match_key, params_hash, rules_fingerprint
+
+        if self.rules is None:
+            self.rules = rules_fingerprint(self.game_kwargs)
+        for generation in (generation_a, generation_b):
+            if generation not in self.params_hashes:
+                self.params_hashes[generation] = params_hash(self.store.load(generation))
+        return match_key(self.params_hashes[generation_a], self.params_hashes[generation_b], seed, self.rules,
+                         rounds=self.rounds, epsilon=self.epsilon)
+
+    def play(self, pairings):
+        # Play every (generation_a, generation_b) pairing once per seed, yielding the results as they finish.
+        # Cached results come first; only the rest is simulated.
+        tasks = []
+        keys = {}
+        for a, b in pairings:
+            for seed in self.seeds:
+                if self.cache is not None:
+                    key = keys[a, b, seed] = self.match_key(a, b, seed)
+                    scores = self.cache.get(key)
+                    if scores is not None:
+                        result = match_result(a, b, seed, *scores)
+                        self.record(result)
+                        yield result
+                        continue
+                tasks.append((self.store_path, a, b, seed, self.rounds, self.epsilon, self.game_kwargs))
+        if not tasks:
+            return
+
+        self.start()
+        for result in self.pool.imap_unordered(_play_match, tasks):
+            self.simulated += 1
+            if self.cache is not None:
+                self.cache.put(keys[result.generation_a, result.generation_b, result.seed], result.score_a,
+                               result.score_b)
+            self.record(result)
+            yield result
+
+    def round_robin(self):
+        return self.play(itertools.combinations(self.generations, 2))
+
+    def swiss_pairings(self):
+        # Pair neighbours in the standings, skipping opponents already met where possible; with an odd
+        # number of generations the lowest rated one sits out
+        met = set((result.generation_a, result.generation_b) for result in self.results)
+        met.update((b, a) for a, b in list(met))
+
+        unpaired = [standing[0] for standing in self.standings()]
+        pairings = []
+        while len(unpaired) > 1:
+            a = unpaired.pop(0)
+            b = next((b for b in unpaired if (a, b) not in met), unpaired[0])
+            unpaired.remove(b)
+            pairings.append((a, b))
+        return pairings
+
+    def swiss(self, num_rounds):
+        # num_rounds Swiss rounds; each round is paired from the ratings after the previous one
+        for _ in range(num_rounds):
+            for result in self.play(self.swiss_pairings()):
+                yield result
@@ -1,17 +1,42 @@
 import pygame
 from pygame import error
 
+# Images are loaded, converted and scaled once per process and then shared by all the sprites
+_image_cache = {}
+_rotation_cache = {}
+
 
 def load_image(name, scale_x, scale_y):
-    # Attempt to load the image
-    try:
-        image = pygame.image.load(name)
-    except error, message:
-        print 'Cannot load image:', name
-        raise SystemExit, message
+    # Headless games have no display to match, so their images are cached separately in the loaded format
+    converted = pygame.display.get_surface() is not None
+    key = name, scale_x, scale_y, converted
+
+    image = _image_cache.get(key)
+    if image is None:
+        # Attempt to load the image
+        try:
+            image = pygame.image.load(name)
+        except error as message:
+            print('Cannot load image: %s' % name)
+            raise SystemExit(message)
 
-    # Makes a new copy of a Surface and converts its color format and depth to match the display
-    image = image.convert()
-    image = pygame.transform.scale(image, (scale_x, scale_y))
+        # Makes a new copy of a Surface and converts its color format and depth to match the display
+        if converted:
+            image = image.convert()
+        image = pygame.transform.scale(image, (scale_x, scale_y))
+        _image_cache[key] = image
 
     return image, image.get_rect()
+
+
+def load_rotations(name, scale_x, scale_y):
+    # The image rotated by each of the four headings a sprite can have, keyed by the angle in degrees
+    key = name, scale_x, scale_y, pygame.display.get_surface() is not None
+
+    rotations = _rotation_cache.get(key)
+    if rotations is None:
+        image, rect = load_image(name, scale_x, scale_y)
+        rotations = dict((angle, pygame.transform.rotate(image, angle)) for angle in (0, 90, 180, 270))
+        _rotation_cache[key] = rotations
+
+    return rotations